@@ -1,4 +1,5 @@
 from .downloader import DownloaderWindow
 from .explorer import Explorer
+from .jobs import JobEngine, JobList
 from .treeselector import TreeSelector
 from .utils import Logger, modal_message
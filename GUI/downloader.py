@@ -1,22 +1,38 @@
-import asyncio
 import logging
 import pathlib
-from datetime import datetime
+from datetime import datetime, time, timedelta
 
 import dearpygui.dearpygui as dpg
-import httpx
 
-from Timelapse import Downloader
+from Timelapse import (
+    Downloader,
+    FrameCatalog,
+    FramePipeline,
+    FrameStore,
+    FrameValidator,
+    VideoMaker,
+    sampling,
+)
+from Timelapse.metrics import Metrics
 
 from . import treeselector, video
+from .jobs import Job, JobEngine
 
 logger = logging.getLogger("GUI.Downloader")
 
 
 class DownloaderWindow:
-    def __init__(self, product_selector: treeselector.TreeSelector, parent):
+    def __init__(
+        self,
+        product_selector: treeselector.TreeSelector,
+        parent,
+        catalog: FrameCatalog,
+        engine: JobEngine,
+    ):
         self.product_selector = product_selector
         self.parent = parent
+        self.catalog = catalog
+        self.engine = engine
 
         now = datetime.now()
         default_date = {
@@ -28,12 +44,48 @@ class DownloaderWindow:
             dpg.add_date_picker(tag="start", default_value=default_date)
         with dpg.collapsing_header(label="End Date"):
             dpg.add_date_picker(tag="end", default_value=default_date)
+        with dpg.collapsing_header(label="Sampling"):
+            dpg.add_input_int(
+                label="Keep every Nth frame", tag="every_nth", default_value=1
+            )
+            dpg.add_input_int(
+                label="One frame per N minutes (0 for all)",
+                tag="one_per",
+                default_value=0,
+            )
+            dpg.add_input_intx(
+                label="Hours of day (UTC, from-to)",
+                tag="hours",
+                size=2,
+                default_value=[0, 24],
+            )
         dpg.add_separator()
 
         with dpg.group():
+            dpg.add_checkbox(
+                label="Resume (skip images that are already downloaded)",
+                tag="resume",
+                default_value=True,
+            )
+            dpg.add_checkbox(
+                label="Share frames with other runs (./Store)",
+                tag="store",
+                default_value=True,
+            )
+            dpg.add_checkbox(
+                label="Re-download truncated, corrupt and blank frames",
+                tag="validate_downloads",
+                default_value=False,
+            )
+            dpg.add_checkbox(
+                label="Encode the video while downloading",
+                tag="pipeline",
+                default_value=False,
+            )
             dpg.add_button(label="Download", callback=self.run)
 
-    async def download(self):
+    def run(self):
+        """Queues the download on the job engine, the preview opens once it's done."""
         name = self.name
         start, end = self.dates
         product = self.product
@@ -43,17 +95,43 @@ class DownloaderWindow:
         logger.info(
             f"Download Settings:\n\tName:\t{name}\n\tStart:\t{start:'%d%b%Y'}\n\tEnd:\t{end:'%d%b%Y'}\n\tProduct:\t{product}"
         )
-        async with httpx.AsyncClient() as client:
-            downloader = Downloader(client, name, product, start, end)  # type: ignore
-            await downloader.run()
+        metrics = Metrics(f"Download {name}")
+        downloader = Downloader(
+            self.engine.client,
+            name,  # type: ignore
+            product,  # type: ignore
+            start,
+            end,
+            resume=dpg.get_value("resume"),
+            filters=self.filters,
+            store=FrameStore() if dpg.get_value("store") else None,
+            catalog=self.catalog,
+            metrics=metrics,
+            validator=FrameValidator() if dpg.get_value("validate_downloads") else None,
+        )
+        if dpg.get_value("pipeline"):
+            video_maker = VideoMaker(
+                name,  # type: ignore
+                downloader.directory,
+                metrics=metrics,
+                runner=self.engine.ffmpeg,
+            )
+            coroutine = FramePipeline(video_maker).run(downloader)
+        else:
+            coroutine = downloader.run()
+        self.engine.submit(
+            Job(
+                f"Download {name}",
+                progress=downloader.progress,
+                on_done=lambda _: self.preview(downloader.directory),
+                metrics=metrics,
+            ),
+            coroutine,
+        )
 
-    def run(self):
-        logger.info("Starting download...")
-        asyncio.run(self.download())
-        logger.info("Done!")
-        path = pathlib.Path(f"./Images/{self.product.path_string}/{self.name}")  # type: ignore
+    def preview(self, path: pathlib.Path):
         try:
-            video.PreviewWindow(path)
+            video.PreviewWindow(path, self.catalog, self.engine)
         except FileNotFoundError:
             logger.error(f"Files not found in {path} !")
 
@@ -67,6 +145,7 @@ class DownloaderWindow:
 
     @property
     def dates(self):
+        """The start date at 00:00 and the end date at 23:59, so that both days are downloaded in full."""
         data = []
         for d in ("start", "end"):
             val: dict = dpg.get_value(d)
@@ -74,8 +153,22 @@ class DownloaderWindow:
             month = val["month"] + 1
             day = val["month_day"]
             data.append(datetime(year, month, day))
+        data[1] = datetime.combine(data[1], time(23, 59))
         return data
 
+    @property
+    def filters(self):
+        filters = []
+        start_hour, end_hour = dpg.get_value("hours")[:2]
+        if (start_hour, end_hour) != (0, 24):
+            end = time(23, 59) if end_hour >= 24 else time(end_hour % 24)
+            filters.append(sampling.TimeOfDay(time(start_hour % 24), end))
+        if dpg.get_value("one_per") > 0:
+            filters.append(sampling.OnePer(timedelta(minutes=dpg.get_value("one_per"))))
+        if dpg.get_value("every_nth") > 1:
+            filters.append(sampling.EveryNth(dpg.get_value("every_nth")))
+        return filters
+
     @property
     def product(self):
         try:
@@ -4,41 +4,49 @@ import pathlib
 import anytree
 import dearpygui.dearpygui as dpg
 
+from Timelapse import FrameCatalog
+
+from .jobs import JobEngine
 from .treeselector import TreeSelector
 from .video import PreviewWindow
 
 logger = logging.getLogger("GUI.Explorer")
 
 
-def load_filesystem_tree(path: pathlib.Path, parent: anytree.Node, is_root=False):
-    if path.is_file():
-        return
-    if not is_root:
-        parent = anytree.Node(path.name, parent=parent)
-    for p in path.iterdir():
-        load_filesystem_tree(p, parent)
+def load_catalog_tree(catalog: FrameCatalog, root: anytree.Node):
+    """Every run in the catalog as a leaf under the nodes of its product path."""
+    nodes = {(): root}
+    for product, run in catalog.runs():
+        path = ()
+        for name in (*product.split("/"), run):
+            parent = nodes[path]
+            path = (*path, name)
+            if path not in nodes:
+                nodes[path] = anytree.Node(name, parent=parent)
 
 
 class Explorer:
-    def __init__(self, parent):
+    def __init__(self, parent, catalog: FrameCatalog, engine: JobEngine):
         self.window_id = parent
+        self.catalog = catalog
+        self.engine = engine
         self.tree_window = None
         dpg.add_button(
             label="Refresh", callback=self._load_directories, parent=self.window_id
         )
         self._load_directories()
 
-    @staticmethod
-    def make_image_window(node: anytree.Node):
+    def make_image_window(self, node: anytree.Node):
         directory = pathlib.Path("/".join(n.name for n in node.path))  # type: ignore
-        PreviewWindow(directory)
+        PreviewWindow(directory, self.catalog, self.engine)
 
     def _load_directories(self):
         folder = pathlib.Path("./Images")
         if not folder.exists():
             folder.mkdir()
+        self.catalog.reconcile(folder)
         root = anytree.Node("Images")
-        load_filesystem_tree(folder, root, is_root=True)
+        load_catalog_tree(self.catalog, root)
         if self.tree_window:
             dpg.delete_item(self.tree_window)
         with dpg.child_window(parent=self.window_id) as self.tree_window:
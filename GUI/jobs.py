@@ -0,0 +1,278 @@
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+import typing
+
+import dearpygui.dearpygui as dpg
+
+from Timelapse import make_client
+from Timelapse.ffmpeg import FFmpegRunner
+from Timelapse.metrics import Metrics
+
+logger = logging.getLogger("GUI.Jobs")
+
+RATE_WINDOW = 5.0
+
+
+def format_bytes(count: float):
+    for unit in ("B", "KB", "MB"):
+        if count < 1024:
+            return f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} GB"
+
+
+def format_duration(seconds: float):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+class Job:
+    """
+    A download or encode handed to the JobEngine.
+
+    progress, if given, is polled from the GUI thread and returns (done, total, bytes) where any of them may be
+    None when the job can't tell. on_done(result) is called on a callback thread once the job finishes without
+    error. Cancelling a job cancels its coroutine, which kills any ffmpeg process it started. metrics are shown in
+    the tooltip of the job's progress bar while it runs and dumped to ./Metrics when it ends.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        progress: typing.Callable[[], tuple] | None = None,
+        on_done: typing.Callable[[typing.Any], None] | None = None,
+        metrics: Metrics | None = None,
+    ):
+        self.name = name
+        self.progress = progress
+        self.on_done = on_done
+        self.metrics = metrics
+        self.status = "queued"
+        self.started: float | None = None
+        self.ended: float | None = None
+        self.future: concurrent.futures.Future | None = None
+        self.samples: collections.deque[tuple[float, int, int]] = collections.deque()
+
+    def sample(self):
+        """Polls progress, returns (fraction or None, description)."""
+        done, total, size = self.progress() if self.progress else (None, None, None)
+        now = time.monotonic()
+        elapsed = now - self.started if self.started else 0
+        parts = []
+        fraction = None
+        if done is not None:
+            parts.append(f"{done}/{total}" if total else f"{done}")
+            if total:
+                fraction = done / total
+        if size:
+            parts.append(format_bytes(size))
+
+        if done is not None:
+            self.samples.append((now, done, size or 0))
+            while now - self.samples[0][0] > RATE_WINDOW:
+                self.samples.popleft()
+            first_time, first_done, first_size = self.samples[0]
+            span = now - first_time
+            if span > 0.5:
+                rate = (done - first_done) / span
+                parts.append(f"{rate:.1f}/s")
+                if size:
+                    parts.append(f"{format_bytes((size - first_size) / span)}/s")
+                if rate > 0 and total:
+                    parts.append(f"ETA {format_duration((total - done) / rate)}")
+        parts.append(format_duration(elapsed))
+        return fraction, "  ".join(parts)
+
+
+class JobEngine:
+    """
+    Runs downloads and encodes on one asyncio loop that lives on a background thread for as long as the app does,
+    so the GUI thread never waits on them. At most max_jobs run at a time, the rest wait their turn in the order
+    they were submitted.
+
+    All downloads share `client`, whose pool caps the connections to MOSDAC (and per_host the requests in flight to
+    each host) across every running job, and all encodes share `ffmpeg`, whose budget caps the cores they use
+    between them.
+    """
+
+    def __init__(
+        self,
+        max_jobs=3,
+        connections=32,
+        cpus: int | None = None,
+        per_host: int | None = None,
+    ):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="JobEngine", daemon=True
+        )
+        self.thread.start()
+        self.client = make_client(max_connections=connections, per_host=per_host)
+        self.ffmpeg = FFmpegRunner(cpus)
+        self.slots = asyncio.Semaphore(max_jobs)
+        self.jobs: list[Job] = []
+        self.finished: queue.SimpleQueue[Job] = queue.SimpleQueue()
+
+    def submit(self, job: Job, coroutine: typing.Coroutine):
+        self.jobs.append(job)
+        job.future = asyncio.run_coroutine_threadsafe(
+            self._run(job, coroutine), self.loop
+        )
+        job.future.add_done_callback(lambda _: self.finished.put(job))
+        logger.info(f"Queued {job.name}")
+        return job
+
+    async def _run(self, job: Job, coroutine: typing.Coroutine):
+        try:
+            async with self.slots:
+                job.status = "running"
+                job.started = time.monotonic()
+                result = await coroutine
+        except asyncio.CancelledError:
+            logger.info(f"Cancelled {job.name}")
+            raise
+        except Exception as e:
+            logger.error(f"{job.name} failed: {e}")
+            raise
+        else:
+            logger.info(f"Finished {job.name}")
+            return result
+        finally:
+            # closes the coroutine if the job was cancelled before it got a slot, a no-op otherwise
+            coroutine.close()
+            if job.metrics and job.started:
+                job.metrics.dump()
+
+    def cancel(self, job: Job):
+        if job.future:
+            job.future.cancel()
+
+    async def _close(self):
+        tasks = [
+            task for task in asyncio.all_tasks() if task is not asyncio.current_task()
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.aclose()
+
+    def poll(self):
+        """Settles the jobs that finished since the last call and returns them, call it from the GUI thread."""
+        finished = []
+        while not self.finished.empty():
+            job = self.finished.get()
+            job.ended = time.monotonic()
+            future: concurrent.futures.Future = job.future  # type: ignore
+            if future.cancelled():
+                job.status = "cancelled"
+            elif future.exception() is not None:
+                job.status = "failed"
+            else:
+                job.status = "done"
+            finished.append(job)
+        return finished
+
+    def remove(self, job: Job):
+        self.jobs.remove(job)
+
+    def shutdown(self, timeout=10):
+        """Cancels every job, waits up to timeout seconds for them to clean up (manifests, .part files) and stops."""
+        for job in self.jobs:
+            self.cancel(job)
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), self.loop).result(timeout)
+        except concurrent.futures.TimeoutError:
+            logger.warning("Jobs did not stop in time")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+
+class JobList:
+    """
+    One row per job with a progress bar and a Cancel button. update() is called once per rendered frame, the text
+    of the bars is refreshed a few times a second.
+    """
+
+    refresh_interval = 0.25
+
+    def __init__(self, engine: JobEngine, parent):
+        self.engine = engine
+        self.rows: dict[Job, tuple[int, int, int, int | None]] = {}
+        self.last_refresh = 0.0
+        self.finished: list[Job] = []
+        with dpg.group(parent=parent):
+            dpg.add_text("Jobs")
+            self.group_id = dpg.add_group()
+
+    def update(self):
+        finished = self.engine.poll()
+        for job in finished:
+            self._finish(job)
+        if finished:
+            self.finished += [job for job in finished if job.status == "done"]
+            # on_done usually opens windows, which like every other dearpygui callback runs off the render thread
+            dpg.set_frame_callback(dpg.get_frame_count() + 1, self._run_callbacks)
+
+        now = time.monotonic()
+        if now - self.last_refresh < self.refresh_interval:
+            return
+        self.last_refresh = now
+        for job in self.engine.jobs:
+            if job not in self.rows:
+                self._add_row(job)
+            if job.status == "running":
+                fraction, text = job.sample()
+                _, bar, _, details = self.rows[job]
+                if details is not None:
+                    dpg.set_value(details, job.metrics.summary())  # type: ignore
+                if fraction is None:
+                    # no total to measure against, keep the bar moving so it doesn't look stuck
+                    fraction = (now - job.started) % 2 / 2  # type: ignore
+                dpg.set_value(bar, fraction)
+                dpg.configure_item(bar, overlay=text)
+
+    def _run_callbacks(self):
+        finished, self.finished = self.finished, []
+        for job in finished:
+            if job.on_done:
+                try:
+                    job.on_done(job.future.result())  # type: ignore
+                except Exception:
+                    logger.exception(f"Error after {job.name} finished")
+
+    def _add_row(self, job: Job):
+        with dpg.group(horizontal=True, parent=self.group_id) as row:
+            dpg.add_text(job.name)
+            bar = dpg.add_progress_bar(width=-80, overlay="queued")
+            button = dpg.add_button(
+                label="Cancel", width=70, callback=lambda: self.engine.cancel(job)
+            )
+        details = None
+        if job.metrics:
+            with dpg.tooltip(bar):
+                details = dpg.add_text("")
+        self.rows[job] = (row, bar, button, details)
+
+    def _finish(self, job: Job):
+        if job not in self.rows:
+            self._add_row(job)
+        row, bar, button, details = self.rows[job]
+        _, text = job.sample() if job.started else (None, "")
+        if details is not None:
+            dpg.set_value(details, job.metrics.summary())  # type: ignore
+        if job.status == "done":
+            dpg.set_value(bar, 1.0)
+        dpg.configure_item(bar, overlay=f"{job.status}  {text}".strip())
+        dpg.configure_item(
+            button, label="Clear", callback=lambda: self._remove_row(job)
+        )
+
+    def _remove_row(self, job: Job):
+        dpg.delete_item(self.rows.pop(job)[0])
+        self.engine.remove(job)
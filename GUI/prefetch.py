@@ -0,0 +1,108 @@
+import collections
+import pathlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import dearpygui.dearpygui as dpg
+
+
+def decode(path: pathlib.Path):
+    image = dpg.load_image(str(path))
+    if image is None:
+        raise ValueError(f"{path} could not be decoded")
+    width, height, _, data = image
+    return width, height, data
+
+
+class FramePrefetcher:
+    """
+    Decodes frames on a small thread pool so the GUI thread only ever swaps textures.
+
+    focus() is told where the cursor is and which way it's moving. It queues decodes for `ahead` frames in that
+    direction and `behind` frames in the other, nearest first. Decoded frames are kept in an LRU of at most
+    `capacity` RGBA buffers; the oldest ones are dropped as new ones come in, so memory stays bounded however far
+    you scrub. get() never blocks, it returns None while a frame is still being decoded and raises if decoding
+    failed.
+
+    dpg.load_image can't decode into an existing buffer, but the buffers of dropped frames are kept on a free-list
+    by size and the next decode of that size is copied into one. While scrubbing, the frames that are kept around
+    reuse the same few buffers and only load_image's short-lived one is new. The buffer get() last returned is
+    never reused, as it's the one on screen.
+    """
+
+    def __init__(self, ahead=8, behind=4, capacity=24, workers=2):
+        self.ahead = ahead
+        self.behind = behind
+        self.capacity = max(capacity, ahead + behind + 1)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.frames: collections.OrderedDict[int, Future] = collections.OrderedDict()
+        self.spare: dict[tuple[int, int], list] = collections.defaultdict(list)
+        self.shown = None
+        self.lock = threading.Lock()
+
+    def decode(self, path: pathlib.Path):
+        width, height, data = decode(path)
+        with self.lock:
+            spare = self.spare[(width, height)]
+            buffer = spare.pop() if spare else None
+        if buffer is None:
+            return width, height, data
+        memoryview(buffer)[:] = memoryview(data)
+        return width, height, buffer
+
+    def recycle(self, future: Future):
+        """Puts the buffer of a dropped frame on the free-list, called with the lock held."""
+        if not future.done() or future.cancelled() or future.exception():
+            return
+        width, height, data = future.result()
+        spare = self.spare[(width, height)]
+        if data is not self.shown and len(spare) < self.ahead + self.behind:
+            spare.append(data)
+
+    def focus(self, index: int, direction: int, total: int, path_for):
+        """path_for(i) gives the path of frame i, it is only called from the calling thread."""
+        direction = direction or 1
+        wanted = [index]
+        for step in range(1, max(self.ahead, self.behind) + 1):
+            if step <= self.ahead:
+                wanted.append(index + step * direction)
+            if step <= self.behind:
+                wanted.append(index - step * direction)
+
+        with self.lock:
+            for i in wanted:
+                if not 0 <= i < total:
+                    continue
+                if i not in self.frames:
+                    self.frames[i] = self.pool.submit(self.decode, path_for(i))
+            # the frames wanted now are the most recently used, anything older goes first
+            for i in reversed(wanted):
+                if i in self.frames:
+                    self.frames.move_to_end(i)
+            while len(self.frames) > self.capacity:
+                _, future = self.frames.popitem(last=False)
+                if not future.cancel():
+                    self.recycle(future)
+
+    def get(self, index: int):
+        with self.lock:
+            future = self.frames.get(index)
+        if future is None or not future.done() or future.cancelled():
+            return None
+        frame = future.result()
+        self.shown = frame[2]
+        return frame
+
+    def clear(self):
+        """Forgets every decoded frame, for when the frames themselves change (e.g. another thumbnail level)."""
+        with self.lock:
+            for future in self.frames.values():
+                future.cancel()
+            self.frames.clear()
+            self.spare.clear()
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            self.frames.clear()
+            self.spare.clear()
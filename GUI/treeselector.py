@@ -1,10 +1,11 @@
 import logging
-import time
 import typing
 
 import anytree
 import dearpygui.dearpygui as dpg
 
+from Timelapse.metrics import log_duration
+
 logger = logging.getLogger("GUI.TreeSelector")
 
 
@@ -24,14 +25,12 @@ class TreeSelector:
         self.root = root
         self.selected_node = None
         self.callback = callback
-        a = time.perf_counter()
-        self.status_text = dpg.add_text(
-            "Select a node from the dropdown menu...", parent=parent
-        )
-        dpg.add_separator()
-        self._render(root, parent)
-        t = time.perf_counter() - a
-        logger.debug(f"{root.name} tree rendered in {t} seconds")
+        with log_duration(logger, f"{root.name} tree rendered"):
+            self.status_text = dpg.add_text(
+                "Select a node from the dropdown menu...", parent=parent
+            )
+            dpg.add_separator()
+            self._render(root, parent)
 
     def click_callback(self, sender, app_data, user_data: anytree.Node):
         self.selected_node = user_data
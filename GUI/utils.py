@@ -1,11 +1,17 @@
+import collections
 import logging
+import time
 
 import dearpygui.dearpygui as dpg
 
 MODAL_HIDDEN_LIST = []
 
 
-def modal_message(message):
+def modal_message(message, center=True):
+    """
+    Returns the modal, or None if the message was hidden. Centering it waits for the next frame, which never comes
+    on the render thread, so from there pass center=False and call center_window() on a later frame.
+    """
     if message in MODAL_HIDDEN_LIST:
         return
     with dpg.mutex():
@@ -22,21 +28,53 @@ def modal_message(message):
                 dpg.add_button(
                     label="Okay", width=75, callback=lambda: dpg.delete_item(warning)
                 )
-    dpg.split_frame()
-    modal_dimensions = dpg.get_item_rect_size(warning)
+    if center:
+        dpg.split_frame()
+        center_window(warning)
+    return warning
+
+
+def center_window(window):
+    modal_dimensions = dpg.get_item_rect_size(window)
     window_dimensions = dpg.get_item_rect_size("Primary Window")
     newPos = [(window_dimensions[i] - modal_dimensions[i]) / 2 for i in range(2)]
-    dpg.configure_item(warning, pos=newPos)
+    dpg.configure_item(window, pos=newPos)
 
 
 class Logger(logging.Handler):
-    def __init__(self, parent):
+    """
+    emit() only formats the record and appends it to a bounded deque, which is safe to do from any thread without
+    taking a lock. drain() runs once per frame on the render thread and turns at most `batch` records into text
+    items, so a burst of DEBUG lines costs a few items per frame instead of a dpg call per record on whatever
+    thread logged it. If the GUI falls that far behind the oldest records are dropped, and a line says how many.
+
+    Lines live in a clipper, so only the visible ones are drawn. Past max_lines the oldest are deleted one at a time
+    as new ones come in. A record identical to the previous line, or a warning or error that is already on screen,
+    bumps a repeat count on the existing line instead of adding another. Errors open a modal, at most one every
+    modal_interval seconds. The ones that come in between are only counted in the next modal.
+    """
+
+    def __init__(
+        self, parent, capacity=10000, max_lines=2000, batch=200, modal_interval=5.0
+    ):
         super().__init__()
         self.log_level = 0
         self._auto_scroll = True
-        self.count = 0
-        self.flush_count = 1000
         self.window_id = parent
+        self.records: collections.deque[tuple[int, tuple, str]] = collections.deque(
+            maxlen=capacity
+        )
+        self.dropped = 0
+        self.max_lines = max_lines
+        self.batch = batch
+        self.lines: collections.deque[tuple[int, tuple | None]] = collections.deque()
+        self.repeats: dict[tuple, list] = {}
+        self.last_key: tuple | None = None
+        self.filter_terms: list[str] = []
+        self.modal_interval = modal_interval
+        self.last_modal = 0.0
+        self.suppressed_errors = 0
+        self.modal_to_center = None
 
         with dpg.group(horizontal=True, parent=self.window_id):
             dpg.add_checkbox(
@@ -44,22 +82,17 @@ class Logger(logging.Handler):
                 default_value=True,
                 callback=lambda sender: self.auto_scroll(dpg.get_value(sender)),
             )
-            dpg.add_button(
-                label="Clear",
-                callback=lambda: dpg.delete_item(self.filter_id, children_only=True),
-            )
+            dpg.add_button(label="Clear", callback=self.clear_log)
 
         dpg.add_input_text(
             label="Filter (inc, -exc)",
-            callback=lambda sender: dpg.set_value(
-                self.filter_id, dpg.get_value(sender)
-            ),
+            callback=lambda sender: self.set_filter(dpg.get_value(sender)),
             parent=self.window_id,
         )
         self.child_id = dpg.add_child_window(
             parent=self.window_id, autosize_x=True, autosize_y=True
         )
-        self.filter_id = dpg.add_filter_set(parent=self.child_id)
+        self.clipper_id = dpg.add_clipper(parent=self.child_id)
 
         with dpg.theme() as self.debug_theme:
             with dpg.theme_component(0):
@@ -81,44 +114,100 @@ class Logger(logging.Handler):
             with dpg.theme_component(0):
                 dpg.add_theme_color(dpg.mvThemeCol_Text, (255, 0, 0, 255))
 
+        self.themes = {
+            logging.DEBUG: self.debug_theme,
+            logging.INFO: self.info_theme,
+            logging.WARNING: self.warning_theme,
+            logging.ERROR: self.error_theme,
+            logging.CRITICAL: self.critical_theme,
+        }
+
     def auto_scroll(self, value):
         self._auto_scroll = value
 
-    def _log(self, message, level):
-        """Different theme for each level"""
-        if level < self.log_level:
+    def emit(self, record):
+        if record.levelno < self.log_level:
             return
-
-        self.count += 1
-
-        if self.count > self.flush_count:
-            self.clear_log()
-
-        theme = self.info_theme
-        if level == 10:
-            theme = self.debug_theme
-        elif level == 20:
-            pass
-        elif level == 30:
-            theme = self.warning_theme
-        elif level == 40:
-            theme = self.error_theme
-            modal_message(message)
-        elif level == 50:
-            theme = self.critical_theme
-            modal_message(message)
-
-        new_log = dpg.add_text(
-            message, parent=self.filter_id, filter_key=message, wrap=0
-        )
-        dpg.bind_item_theme(new_log, theme)
-        if self._auto_scroll:
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        key = (record.levelno, record.name, record.getMessage())
+        self.records.append((record.levelno, key, self.format(record)))
+
+    def drain(self):
+        """Call once per frame from the render loop."""
+        if self.modal_to_center is not None:
+            center_window(self.modal_to_center)
+            self.modal_to_center = None
+
+        added = False
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self._add_line(f"... {dropped} log lines dropped ...", logging.WARNING)
+            added = True
+        for _ in range(min(self.batch, len(self.records))):
+            level, key, message = self.records.popleft()
+            self._log(message, level, key)
+            added = True
+        if added and self._auto_scroll:
             dpg.set_y_scroll(self.child_id, -1.0)
 
-    def emit(self, record):
-        string = self.format(record)
-        self._log(string, record.levelno)
+    def _log(self, message, level, key):
+        repeat = self.repeats.get(key)
+        if repeat and (key == self.last_key or level >= logging.WARNING):
+            repeat[1] += 1
+            first_line = message.split("\n", 1)[0]
+            dpg.set_value(repeat[0], f"{first_line} (x{repeat[1]})")
+        else:
+            lines = message.split("\n")
+            first = self._add_line(lines[0], level, key)
+            for line in lines[1:]:
+                self._add_line(line, level)
+            self.repeats[key] = [first, 1]
+            if self.last_key is not None and self.last_key[0] < logging.WARNING:
+                # below warnings only consecutive repeats are folded
+                self.repeats.pop(self.last_key, None)
+        self.last_key = key
+
+        if level >= logging.ERROR:
+            self._error_modal(message)
+
+    def _add_line(self, text, level, key=None):
+        # one item per line and no wrapping, the clipper assumes every item has the same height
+        item = dpg.add_text(text, parent=self.clipper_id, show=self._matches(text))
+        dpg.bind_item_theme(item, self.themes.get(level, self.info_theme))
+        self.lines.append((item, key))
+        while len(self.lines) > self.max_lines:
+            old, old_key = self.lines.popleft()
+            if old_key is not None and self.repeats.get(old_key, [None])[0] == old:
+                del self.repeats[old_key]
+            dpg.delete_item(old)
+        return item
+
+    def _error_modal(self, message):
+        now = time.monotonic()
+        if now - self.last_modal < self.modal_interval:
+            self.suppressed_errors += 1
+            return
+        if self.suppressed_errors:
+            message += f"\n\n(and {self.suppressed_errors} more errors, see the log)"
+            self.suppressed_errors = 0
+        self.last_modal = now
+        self.modal_to_center = modal_message(message, center=False)
+
+    def _matches(self, text):
+        included = [term for term in self.filter_terms if not term.startswith("-")]
+        excluded = [term[1:] for term in self.filter_terms if term.startswith("-")]
+        if any(term and term in text for term in excluded):
+            return False
+        return not included or any(term in text for term in included)
+
+    def set_filter(self, value: str):
+        self.filter_terms = [term.strip() for term in value.split(",") if term.strip()]
+        for item, _ in self.lines:
+            dpg.configure_item(item, show=self._matches(dpg.get_value(item)))
 
     def clear_log(self):
-        dpg.delete_item(self.filter_id, children_only=True)
-        self.count = 0
+        dpg.delete_item(self.clipper_id, children_only=True)
+        self.lines.clear()
+        self.repeats.clear()
+        self.last_key = None
@@ -1,18 +1,55 @@
+import asyncio
 import logging
+import math
 import pathlib
-import re
-from itertools import chain
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import dearpygui.dearpygui as dpg
 
-from Timelapse import VideoMaker
+from Timelapse import (
+    PROFILES,
+    FrameCatalog,
+    FrameValidator,
+    Preprocess,
+    ThumbnailCache,
+    VideoMaker,
+)
+from Timelapse.catalog import split_run_directory
+from Timelapse.metrics import Metrics
+from Timelapse.sequence import frame_sequence
+
+from .jobs import Job, JobEngine
+from .prefetch import FramePrefetcher, decode
 
 logger = logging.getLogger("GUI.Video")
 
 
+async def run_encode(encode):
+    """Awaits one of VideoMaker's encodes, raising if ffmpeg fails."""
+    code = await encode()
+    if code != 0:
+        raise RuntimeError(f"ffmpeg exited with {code}")
+    return code
+
+
+async def encode_sequence(
+    video: VideoMaker, encode, validator: FrameValidator | None, hold_gaps: bool
+):
+    """run_encode on the run's frames in chronological order, see Timelapse.sequence.frame_sequence."""
+    video.frames, video.durations = await asyncio.to_thread(
+        frame_sequence,
+        video.directory,
+        video.framerate,
+        validator=validator,
+        hold_gaps=hold_gaps,
+    )
+    return await run_encode(encode)
+
+
 class VideoPrompt:
-    def __init__(self, directory: pathlib.Path):
+    def __init__(self, directory: pathlib.Path, engine: JobEngine):
         self.directory = directory
+        self.engine = engine
         with dpg.mutex():
             with dpg.window(
                 modal=True, autosize=True, no_resize=True, no_title_bar=True
@@ -26,7 +63,45 @@ class VideoPrompt:
                 with dpg.group(horizontal=True):
                     dpg.add_text("Framerate ")
                     dpg.add_input_int(tag="framerate", default_value=24)
-                dpg.add_separator(pos=(-1, 70))
+                with dpg.group(horizontal=True):
+                    dpg.add_text("Segments  ")
+                    dpg.add_input_int(tag="segments", default_value=1, min_value=1)
+                with dpg.group(horizontal=True):
+                    dpg.add_text("Threads   ")
+                    dpg.add_input_int(tag="threads", default_value=0, min_value=0)
+                with dpg.group(horizontal=True):
+                    dpg.add_text("GOP       ")
+                    dpg.add_input_int(tag="gop", default_value=250, min_value=1)
+                with dpg.group(horizontal=True):
+                    dpg.add_text("Crop      ")
+                    dpg.add_input_intx(
+                        tag="crop", size=4, default_value=[0, 0, 0, 0], width=200
+                    )
+                    dpg.add_text("x, y, width, height (0 size for the full frame)")
+                with dpg.group(horizontal=True):
+                    dpg.add_text("Scale to  ")
+                    dpg.add_input_intx(
+                        tag="size", size=2, default_value=[0, 0], width=200
+                    )
+                    dpg.add_text("width, height (0 keeps the aspect ratio)")
+                dpg.add_checkbox(label="Stretch contrast", tag="stretch")
+                dpg.add_checkbox(
+                    label="Only encode frames added since the last time", tag="append"
+                )
+                dpg.add_checkbox(
+                    label="Leave out corrupt, blank and duplicate frames",
+                    tag="skip_bad_frames",
+                )
+                dpg.add_checkbox(
+                    label="Hold frames over gaps (keeps the video in real time)",
+                    tag="hold_gaps",
+                )
+                with dpg.group(horizontal=True):
+                    dpg.add_text("Outputs   ")
+                    for name in PROFILES:
+                        dpg.add_checkbox(label=name, tag=f"profile {name}")
+                    dpg.add_text("(none for a single mp4)")
+                dpg.add_separator()
                 with dpg.group(horizontal=True, tag="button group"):
                     dpg.add_button(label="Create", width=75, callback=self._make_video)
                     dpg.add_button(label="Close", width=75, callback=self._close)
@@ -37,9 +112,31 @@ class VideoPrompt:
         dpg.configure_item(self.window, pos=newPos)
 
     def _make_video(self):
-        dpg.delete_item("button group")
-        dpg.add_loading_indicator(parent=self.window)
-        VideoMaker(self.name, self.directory, self.framerate).make_video()
+        if dpg.get_value("append") and self.profiles:
+            logger.error("Output profiles can't be appended to, use one or the other")
+            return
+        try:
+            video = VideoMaker(
+                self.name,
+                self.directory,
+                self.framerate,
+                segments=max(dpg.get_value("segments"), 1),
+                threads=max(dpg.get_value("threads"), 0),
+                gop=max(dpg.get_value("gop"), 1),
+                metrics=Metrics(f"Encode {self.name}"),
+                preprocess=self.preprocess,
+                runner=self.engine.ffmpeg,
+                profiles=self.profiles,
+            )
+        except ValueError as e:
+            logger.error(e)
+            return
+        encode = video.append_video if dpg.get_value("append") else video.make_video
+        validator = FrameValidator() if dpg.get_value("skip_bad_frames") else None
+        self.engine.submit(
+            Job(f"Encode {video.name}", progress=video.progress, metrics=video.metrics),
+            encode_sequence(video, encode, validator, dpg.get_value("hold_gaps")),
+        )
         self._close()
 
     def _close(self):
@@ -57,22 +154,72 @@ class VideoPrompt:
     def framerate(self):
         return dpg.get_value("framerate") or 24
 
+    @property
+    def profiles(self):
+        return [
+            profile
+            for name, profile in PROFILES.items()
+            if dpg.get_value(f"profile {name}")
+        ]
 
-class PreviewWindow:
-    def __init__(self, directory: pathlib.Path):
-        self.image_list = list(
-            chain.from_iterable(directory.glob(ext) for ext in ("*.jpg", "*.png"))
-        )
-        self.image_list.sort(
-            key=lambda x: [
-                int(c) if c.isdigit() else c for c in re.split(r"(\d+)", str(x))
-            ]
+    @property
+    def preprocess(self):
+        x, y, width, height = dpg.get_value("crop")[:4]
+        scale_width, scale_height = dpg.get_value("size")[:2]
+        return Preprocess(
+            crop=(x, y, width, height) if width > 0 and height > 0 else None,
+            width=scale_width if scale_width > 0 else None,
+            height=scale_height if scale_height > 0 else None,
+            stretch=dpg.get_value("stretch"),
         )
 
-        if len(self.image_list) == 0:
-            logger.error(f"No *.jpg *.png or *.gif found in {directory}")
+
+class PreviewWindow:
+    """
+    Pages through the frames of a run in the order the catalog keeps them, page_size paths at a time, so opening a
+    run with tens of thousands of frames doesn't list the whole directory first.
+
+    Frames are decoded ahead of the cursor by a FramePrefetcher. Next/Previous only ask for a frame, and the
+    texture is swapped on the first GUI frame where it's ready. Holding a button therefore scrubs as fast as
+    frames decode without ever blocking the GUI thread.
+
+    What gets decoded is the smallest thumbnail level that still has a pixel for every screen pixel at the
+    current zoom, or the original once you zoom in past the largest level. Thumbnails for a page of frames are
+    made in the background the first time it's visited.
+    """
+
+    page_size = 500
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        catalog: FrameCatalog,
+        engine: JobEngine,
+        thumbnails: ThumbnailCache | None = None,
+        start=0,
+    ):
+        self.directory = directory
+        self.catalog = catalog
+        self.engine = engine
+        self.thumbnails = thumbnails or ThumbnailCache()
+        self.product, self.run = split_run_directory(directory)
+        self.total = catalog.count(self.product, self.run)
+        if self.total == 0:
+            catalog.reconcile_directory(directory)
+            catalog.commit()
+            self.total = catalog.count(self.product, self.run)
+
+        if self.total == 0:
+            logger.error(f"No *.jpg or *.png found in {directory}")
             return
-        self.index = 0
+        self.index = min(max(start, 0), self.total - 1)
+        self.page_start = 0
+        self.page: list[pathlib.Path] = []
+        self.pending: int | None = None
+        self.direction = 1
+        self.level: int | None = None
+        self.prefetcher = FramePrefetcher()
+        self.thumbnail_pool = ThreadPoolExecutor(max_workers=1)
 
         with dpg.window(
             label="ImageWindow", pos=(20, 100), width=500, height=500, no_title_bar=True
@@ -82,23 +229,33 @@ class PreviewWindow:
                 dpg.add_button(label="Next", tag=f"next-{self.window_id}")
                 dpg.add_button(label="Close", callback=self._close)
                 dpg.add_button(
-                    label="Make Video", callback=lambda: VideoPrompt(directory)
+                    label="Make Video", callback=lambda: VideoPrompt(directory, engine)
+                )
+                dpg.add_button(
+                    label="Contact Sheet",
+                    callback=lambda: ContactSheet(
+                        directory, catalog, engine, self.thumbnails
+                    ),
                 )
 
         with dpg.child_window(
             parent=self.window_id, autosize_x=True, autosize_y=True
         ) as self.image_window:
-            width, height, _, data = dpg.load_image(str(self.image_list[self.index]))
+            width, height, _, data = dpg.load_image(str(self.image_path(self.index)))
+            self.width, self.height = width, height
             with dpg.texture_registry() as self.registry:
                 dpg.add_raw_texture(width, height, data, tag=f"image-{self.window_id}")
+            # one texture per size, levels of the same frame have different sizes
+            self.textures = {(width, height): f"image-{self.window_id}"}
             with dpg.plot(
-                label=self.image_list[self.index].name,
+                label=self.image_path(self.index).name,
                 parent=self.image_window,
                 width=-1,
                 height=-1,
                 equal_aspects=True,
             ) as self.image:
                 # Dummy bar series to trick the scale and zoom out to fit the image
+                dpg.add_plot_axis(dpg.mvXAxis, tag=f"x-{self.window_id}")
                 dpg.add_plot_axis(dpg.mvYAxis, tag=f"y-{self.window_id}")
                 dpg.add_bar_series(
                     [-width / 2, 0, width / 2],
@@ -106,16 +263,22 @@ class PreviewWindow:
                     weight=1,
                     parent=f"y-{self.window_id}",
                 )
+                # the image covers the original's size in plot units whatever the size of the texture
                 dpg.draw_image(
                     f"image-{self.window_id}",
                     (-width / 2, height / 2),
                     (width / 2, -height / 2),
+                    tag=f"draw-{self.window_id}",
                 )
 
+        self.prefetcher.focus(self.index, 1, self.total, self.frame_path)
+
         with dpg.item_handler_registry(tag=f"playHandler-{self.window_id}"):
-            dpg.add_item_active_handler(callback=lambda: self._load_texture(1))
+            dpg.add_item_active_handler(callback=lambda: self._step(1))
         with dpg.item_handler_registry(tag=f"rewindHandler-{self.window_id}"):
-            dpg.add_item_active_handler(callback=lambda: self._load_texture(-1))
+            dpg.add_item_active_handler(callback=lambda: self._step(-1))
+        with dpg.item_handler_registry(tag=f"swapHandler-{self.window_id}"):
+            dpg.add_item_visible_handler(callback=self._load_texture)
 
         dpg.bind_item_handler_registry(
             f"next-{self.window_id}", f"playHandler-{self.window_id}"
@@ -123,18 +286,194 @@ class PreviewWindow:
         dpg.bind_item_handler_registry(
             f"previous-{self.window_id}", f"rewindHandler-{self.window_id}"
         )
+        dpg.bind_item_handler_registry(self.image, f"swapHandler-{self.window_id}")
+
+    def image_path(self, index: int):
+        if not self.page_start <= index < self.page_start + len(self.page):
+            self.page_start = index - index % self.page_size
+            rows = self.catalog.frames(
+                self.product, self.run, self.page_start, self.page_size
+            )
+            self.page = [pathlib.Path(row["path"]) for row in rows]
+            self.thumbnail_pool.submit(self.thumbnails.ensure, self.page)
+        return self.page[index - self.page_start]
+
+    def frame_path(self, index: int):
+        return self.thumbnails.get(self.image_path(index), self.level)
+
+    def _wanted_level(self):
+        x_min, x_max = dpg.get_axis_limits(f"x-{self.window_id}")
+        plot_width = dpg.get_item_rect_size(self.image)[0]
+        if x_max <= x_min or plot_width <= 0:
+            return self.level
+        return self.thumbnails.level_for(self.width * plot_width / (x_max - x_min))
 
-    def _load_texture(self, i):
-        if (self.index > 0 and i == -1) or (
-            self.index < len(self.image_list) - 1 and i == 1
-        ):
-            self.index += i
-        file = self.image_list[self.index]
-        _, _, _, data = dpg.load_image(str(file))
-        dpg.set_value(f"image-{self.window_id}", data)
+    def _step(self, i):
+        if self.pending is not None:
+            return
+        target = min(max(self.index + i, 0), self.total - 1)
+        if target != self.index:
+            self.direction = i
+            self.pending = target
+            self._load_texture()
+
+    def _load_texture(self):
+        """
+        Runs every frame while the preview is visible. Reloads the current frame if the zoom calls for another
+        level, and shows the pending frame once it has been decoded.
+        """
+        level = self._wanted_level()
+        if level != self.level:
+            self.level = level
+            self.prefetcher.clear()
+            if self.pending is None:
+                self.pending = self.index
+        if self.pending is None:
+            return
+        self.prefetcher.focus(self.pending, self.direction, self.total, self.frame_path)
+        file = self.image_path(self.pending)
+        try:
+            frame = self.prefetcher.get(self.pending)
+        except Exception as e:
+            logger.error(f"Could not load {file}: {e}")
+            self.index, self.pending = self.pending, None
+            return
+        if frame is None:
+            return
+        width, height, data = frame
+        texture = self.textures.get((width, height))
+        if texture is None:
+            texture = dpg.add_raw_texture(width, height, data, parent=self.registry)
+            self.textures[(width, height)] = texture
+        else:
+            dpg.set_value(texture, data)
+        dpg.configure_item(f"draw-{self.window_id}", texture_tag=texture)
         dpg.configure_item(self.image, label=file.name)
+        self.index, self.pending = self.pending, None
 
     def _close(self):
+        self.prefetcher.close()
+        self.thumbnail_pool.shutdown(wait=False, cancel_futures=True)
+        dpg.delete_item(f"swapHandler-{self.window_id}")
         dpg.delete_item(self.window_id)
         dpg.delete_item(f"image-{self.window_id}")
         dpg.delete_item(self.registry)
+
+
+class ContactSheet:
+    """
+    A grid of the smallest thumbnails of a run, page_size frames at a time. Thumbnails are made and decoded on a
+    background thread, the GUI thread only turns them into textures. Clicking a frame opens it in a PreviewWindow.
+    """
+
+    page_size = 120
+    columns = 10
+    cell_width = 128
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        catalog: FrameCatalog,
+        engine: JobEngine,
+        thumbnails: ThumbnailCache,
+    ):
+        self.directory = directory
+        self.catalog = catalog
+        self.engine = engine
+        self.thumbnails = thumbnails
+        self.product, self.run = split_run_directory(directory)
+        self.total = catalog.count(self.product, self.run)
+        self.pages = max(math.ceil(self.total / self.page_size), 1)
+        self.page = 0
+        self.future: Future | None = None
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+        with dpg.window(
+            label=f"Contact Sheet - {directory.name}", width=1400, height=800
+        ) as self.window_id:
+            with dpg.group(horizontal=True):
+                dpg.add_button(label="Previous Page", callback=lambda: self._turn(-1))
+                dpg.add_button(label="Next Page", callback=lambda: self._turn(1))
+                dpg.add_button(label="Close", callback=self._close)
+                self.status = dpg.add_text("")
+            self.grid = dpg.add_child_window(autosize_x=True, autosize_y=True)
+        self.registry = dpg.add_texture_registry()
+
+        with dpg.item_handler_registry() as self.handler:
+            dpg.add_item_visible_handler(callback=self._poll)
+        dpg.bind_item_handler_registry(self.status, self.handler)
+        self._load_page()
+
+    def _turn(self, i):
+        page = min(max(self.page + i, 0), self.pages - 1)
+        if page != self.page:
+            self.page = page
+            self._load_page()
+
+    def _load_page(self):
+        dpg.set_value(self.status, f"Page {self.page + 1}/{self.pages} (loading...)")
+        rows = self.catalog.frames(
+            self.product, self.run, self.page * self.page_size, self.page_size
+        )
+        paths = [pathlib.Path(row["path"]) for row in rows]
+        self.future = self.pool.submit(self._decode_page, self.page, paths)
+
+    def _decode_page(self, page: int, paths: list[pathlib.Path]):
+        self.thumbnails.ensure(paths)
+        decoded = []
+        for path in paths:
+            try:
+                decoded.append(
+                    decode(self.thumbnails.get(path, self.thumbnails.levels[0]))
+                )
+            except ValueError as e:
+                logger.warning(e)
+                decoded.append(None)
+        return page, decoded
+
+    def _poll(self):
+        if self.future is None or not self.future.done():
+            return
+        page, decoded = self.future.result()
+        self.future = None
+        if page != self.page:
+            return
+
+        dpg.delete_item(self.grid, children_only=True)
+        dpg.delete_item(self.registry, children_only=True)
+        with dpg.table(header_row=False, parent=self.grid):
+            for _ in range(self.columns):
+                dpg.add_table_column()
+            for row_start in range(0, len(decoded), self.columns):
+                with dpg.table_row():
+                    for offset, frame in enumerate(
+                        decoded[row_start : row_start + self.columns]
+                    ):
+                        index = page * self.page_size + row_start + offset
+                        if frame is None:
+                            dpg.add_text(f"{index + 1}: unreadable")
+                            continue
+                        width, height, data = frame
+                        texture = dpg.add_static_texture(
+                            width, height, data, parent=self.registry
+                        )
+                        dpg.add_image_button(
+                            texture,
+                            width=self.cell_width,
+                            height=int(self.cell_width * height / width),
+                            user_data=index,
+                            callback=lambda s, a, u: PreviewWindow(
+                                self.directory,
+                                self.catalog,
+                                self.engine,
+                                self.thumbnails,
+                                start=u,
+                            ),
+                        )
+        dpg.set_value(self.status, f"Page {self.page + 1}/{self.pages}")
+
+    def _close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        dpg.delete_item(self.handler)
+        dpg.delete_item(self.window_id)
+        dpg.delete_item(self.registry)
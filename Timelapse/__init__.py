@@ -1,3 +1,12 @@
+from . import sampling
+from .catalog import FrameCatalog
+from .client import make_client
 from .downloader import Downloader
+from .metrics import Metrics
+from .mosaic import MosaicMaker
+from .pipeline import FramePipeline
 from .settings import make_settings_tree
-from .video import VideoMaker
+from .store import FrameStore
+from .thumbnails import ThumbnailCache
+from .validation import FrameValidator
+from .video import PROFILES, OutputProfile, Preprocess, VideoMaker
@@ -0,0 +1,224 @@
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+from datetime import datetime
+
+from .manifest import MANIFEST_NAME, Manifest
+from .sampling import parse_timestamp
+
+logger = logging.getLogger("Timelapse.Catalog")
+
+IMAGES_ROOT = pathlib.Path("./Images")
+CATALOG_PATH = IMAGES_ROOT / "catalog.sqlite3"
+IMAGE_EXTENSIONS = (".jpg", ".png")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    path TEXT PRIMARY KEY,
+    product TEXT NOT NULL,
+    run TEXT NOT NULL,
+    number INTEGER,
+    timestamp TEXT,
+    size INTEGER,
+    hash TEXT,
+    status TEXT NOT NULL,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS frames_by_run ON frames (product, run, number);
+CREATE INDEX IF NOT EXISTS frames_by_time ON frames (product, timestamp);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    has_frames INTEGER NOT NULL
+);
+"""
+
+
+def split_run_directory(directory: pathlib.Path, root: pathlib.Path = IMAGES_ROOT):
+    """./Images/<product path>/<run> -> (product path, run)"""
+    relative = directory.relative_to(root)
+    return relative.parent.as_posix(), relative.name
+
+
+class FrameCatalog:
+    """
+    An index of every frame under ./Images in a SQLite database, so that listing runs or paging through the frames
+    of one doesn't have to walk the filesystem.
+
+    The Downloader records each frame as it settles. Files that change outside the app are picked up by
+    reconcile(), which only lists directories whose mtime changed since the last time. Frames are always written
+    through a .part file and renamed into place, and that rename bumps the directory's mtime.
+
+    One connection is shared by the threads that use the catalog, guarded by a lock. Writes are committed every
+    commit_every records, or on commit().
+    """
+
+    def __init__(self, path: pathlib.Path = CATALOG_PATH, commit_every=200):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.commit_every = commit_every
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self._lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def record(
+        self,
+        path: pathlib.Path,
+        product: str,
+        run: str,
+        number: int | None,
+        timestamp: datetime | None,
+        status: str,
+        size: int | None = None,
+        hash: str | None = None,
+        mtime: float | None = None,
+    ):
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(path),
+                    product,
+                    run,
+                    number,
+                    timestamp.isoformat() if timestamp else None,
+                    size,
+                    hash,
+                    status,
+                    mtime,
+                ),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._commit()
+
+    def commit(self):
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        self.connection.commit()
+        self._uncommitted = 0
+
+    def runs(self):
+        """(product, run) of every run with at least one frame on disk, sorted."""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT product, run FROM frames WHERE status = 'complete' "
+                "ORDER BY product, run"
+            ).fetchall()
+        return [(row["product"], row["run"]) for row in rows]
+
+    def count(self, product: str, run: str):
+        with self._lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM frames WHERE product = ? AND run = ? AND status = 'complete'",
+                (product, run),
+            ).fetchone()[0]
+
+    def frames(self, product: str, run: str, offset=0, limit=-1):
+        """Frames of a run that are on disk in frame order, `limit` at a time starting at `offset`."""
+        with self._lock:
+            return self.connection.execute(
+                "SELECT * FROM frames WHERE product = ? AND run = ? AND status = 'complete' "
+                "ORDER BY number IS NULL, number, path LIMIT ? OFFSET ?",
+                (product, run, limit, offset),
+            ).fetchall()
+
+    def reconcile(self, root: pathlib.Path = IMAGES_ROOT):
+        """
+        Brings the catalog in line with the files under root. Directories that contain frames and whose mtime
+        hasn't changed since the last reconcile are not listed again. Hidden directories are skipped.
+        """
+        with self._lock:
+            known = {
+                row["path"]: (row["mtime"], row["has_frames"])
+                for row in self.connection.execute("SELECT * FROM directories")
+            }
+        seen = set()
+        self._reconcile(root, root, known, seen)
+        with self._lock:
+            for path in set(known) - seen:
+                prefix = os.path.join(path, "")
+                self.connection.execute(
+                    "DELETE FROM directories WHERE path = ?", (path,)
+                )
+                self.connection.execute(
+                    "DELETE FROM frames WHERE substr(path, 1, ?) = ?",
+                    (len(prefix), prefix),
+                )
+            self._commit()
+
+    def _reconcile(self, directory: pathlib.Path, root, known: dict, seen: set):
+        seen.add(str(directory))
+        mtime = directory.stat().st_mtime
+        old_mtime, has_frames = known.get(str(directory), (None, False))
+        if old_mtime == mtime and has_frames:
+            return
+
+        has_frames = False
+        for entry in os.scandir(directory):
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                self._reconcile(pathlib.Path(entry.path), root, known, seen)
+            elif entry.name.endswith(IMAGE_EXTENSIONS):
+                has_frames = True
+        if has_frames and directory != root:
+            self.reconcile_directory(directory, root)
+
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+                (str(directory), mtime, has_frames),
+            )
+
+    def reconcile_directory(
+        self, directory: pathlib.Path, root: pathlib.Path = IMAGES_ROOT
+    ):
+        """Re-indexes the frames of a single run directory."""
+        product, run = split_run_directory(directory, root)
+        manifest = Manifest(directory) if (directory / MANIFEST_NAME).exists() else None
+        with self._lock:
+            indexed = {
+                row["path"]: (row["size"], row["mtime"])
+                for row in self.connection.execute(
+                    "SELECT path, size, mtime FROM frames "
+                    "WHERE product = ? AND run = ? AND status = 'complete'",
+                    (product, run),
+                )
+            }
+
+        on_disk = set()
+        for entry in os.scandir(directory):
+            if not entry.name.endswith(IMAGE_EXTENSIONS):
+                continue
+            path = str(pathlib.Path(entry.path))
+            on_disk.add(path)
+            stat = entry.stat()
+            if indexed.get(path) == (stat.st_size, stat.st_mtime):
+                continue
+            stem = entry.name.rsplit(".", 1)[0]
+            entry_info = manifest.get(entry.name) if manifest else None
+            self.record(
+                pathlib.Path(path),
+                product,
+                run,
+                int(stem) if stem.isdigit() else None,
+                parse_timestamp(entry_info.url) if entry_info else None,
+                "complete",
+                size=stat.st_size,
+                hash=entry_info.checksum if entry_info else None,
+                mtime=stat.st_mtime,
+            )
+
+        with self._lock:
+            for path in set(indexed) - on_disk:
+                self.connection.execute("DELETE FROM frames WHERE path = ?", (path,))
+        logger.debug(f"Reconciled {directory}")
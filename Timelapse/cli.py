@@ -0,0 +1,621 @@
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+import pathlib
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+
+import anytree
+import httpx
+
+from . import sampling, settings
+from .catalog import FrameCatalog
+from .client import make_client
+from .downloader import Downloader
+from .ffmpeg import FFmpegRunner
+from .metrics import METRICS_DIRECTORY, Metrics
+from .mosaic import MosaicMaker, check_layout, mosaic_sequence
+from .pipeline import FramePipeline
+from .sequence import frame_sequence
+from .store import FrameStore
+from .validation import FrameValidator
+from .video import PROFILES, Preprocess, VideoMaker
+
+logger = logging.getLogger("Timelapse.CLI")
+
+
+def parse_date(text: str, end=False):
+    """
+    2023-07-21 or 2023-07-21T06:30. A bare end date means the end of that day, same as the date pickers in the
+    GUI, so that both days are downloaded in full.
+    """
+    date = datetime.fromisoformat(text)
+    if end and len(text) == len("YYYY-MM-DD"):
+        date = datetime.combine(date, time(23, 59))
+    return date
+
+
+def resolve_product(tree: anytree.Node, path: str) -> settings.Product:
+    """
+    Finds a product in the settings tree by its path, with or without the root:
+
+        INSAT-3D/IMAGER/Standard(Full Disk)/Shortwave Infrared
+        /Settings/INSAT-3D/IMAGER/Standard(Full Disk)/Shortwave Infrared
+    """
+    path = path.strip("/")
+    if path.split("/", 1)[0] != tree.name:
+        path = f"{tree.name}/{path}"
+    node = anytree.Resolver().get(tree, f"/{path}")
+    if not isinstance(node, settings.Product):
+        raise ValueError(
+            f"{path} is not a product, it has {len(node.children)} children"
+        )
+    return node
+
+
+@dataclass
+class Job:
+    """
+    One download (one per product for a mosaic) and optionally one video, the fields are the same as the keys of a
+    job file entry.
+    """
+
+    product: str
+    start: datetime
+    end: datetime
+    name: str | None = None
+    every_nth: int = 1
+    one_per: int = 0
+    hours: tuple[int, int] = (0, 24)
+    resume: bool = True
+    store: bool = True
+    workers: int = 64
+    video: bool = True
+    pipeline: bool = False
+    append: bool = False
+    framerate: int = 24
+    segments: int = 1
+    threads: int = 0
+    gop: int = 250
+    crop: tuple[int, int, int, int] | None = None
+    width: int | None = None
+    height: int | None = None
+    stretch: bool = False
+    validate: bool = False
+    hold_gaps: bool = False
+    encode_timeout: float | None = None
+    profiles: list[str] = dataclasses.field(default_factory=list)
+    mosaic: list[str] = dataclasses.field(default_factory=list)
+    tile: tuple[int, int] = (720, 720)
+    columns: int | None = None
+
+    def __post_init__(self):
+        if isinstance(self.start, str):
+            self.start = parse_date(self.start)
+        if isinstance(self.end, str):
+            self.end = parse_date(self.end, end=True)
+        self.hours = tuple(self.hours)  # type: ignore
+        self.tile = tuple(self.tile)  # type: ignore
+        if self.name is None:
+            self.name = f"{self.start:%d%b%Y}_{self.end:%d%b%Y}"
+        if self.gop < 1:
+            raise ValueError(f"The GOP should be at least 1 frame, not {self.gop}")
+        if self.append and self.profiles:
+            raise ValueError(
+                "Output profiles can't be appended to, use one or the other"
+            )
+        if self.video and self.pipeline:
+            # a pipelined encode is a single stream of frames in download order
+            unsupported = [
+                name
+                for name, used in (
+                    ("segments", self.segments > 1),
+                    ("append", self.append),
+                    ("hold_gaps", self.hold_gaps),
+                )
+                if used
+            ]
+            if unsupported:
+                raise ValueError(
+                    f"pipeline can't be combined with {', '.join(unsupported)}"
+                )
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        known = {field.name for field in dataclasses.fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown job keys: {', '.join(sorted(unknown))}")
+        return cls(**data)
+
+    @property
+    def products(self):
+        """product, followed by the products tiled next to it in a mosaic."""
+        return [self.product, *self.mosaic]
+
+    @property
+    def preprocess(self):
+        return Preprocess(self.crop, self.width, self.height, self.stretch)
+
+    @property
+    def output_profiles(self):
+        unknown = [name for name in self.profiles if name not in PROFILES]
+        if unknown:
+            raise ValueError(f"Unknown output profiles: {', '.join(unknown)}")
+        return [PROFILES[name] for name in self.profiles]
+
+    @property
+    def filters(self):
+        filters = []
+        start_hour, end_hour = self.hours
+        if (start_hour, end_hour) != (0, 24):
+            end = time(23, 59) if end_hour >= 24 else time(end_hour % 24)
+            filters.append(sampling.TimeOfDay(time(start_hour % 24), end))
+        if self.one_per > 0:
+            filters.append(sampling.OnePer(timedelta(minutes=self.one_per)))
+        if self.every_nth > 1:
+            filters.append(sampling.EveryNth(self.every_nth))
+        return filters
+
+
+def load_jobs(path: pathlib.Path):
+    """A job file is a JSON list of jobs, each one an object with the fields of Job."""
+    data = json.loads(path.read_text())
+    if not isinstance(data, list):
+        raise ValueError(f"{path} should contain a list of jobs")
+    return [Job.from_dict(item) for item in data]
+
+
+async def run_job(
+    job: Job,
+    product: settings.Product,
+    client: httpx.AsyncClient,
+    store: FrameStore | None,
+    catalog: FrameCatalog,
+    metrics_directory: pathlib.Path | None = METRICS_DIRECTORY,
+    runner: FFmpegRunner | None = None,
+    mosaic: list[settings.Product] | None = None,
+):
+    logger.info(f"Starting {job.name} ({product.path_string})")
+    metrics = Metrics(job.name)  # type: ignore
+    products = [product, *mosaic] if mosaic else []
+    # the downloads of a mosaic run side by side, each with its own workers to account for
+    downloads = [Metrics(f"{job.name}-{p.path_string}") for p in products]
+    try:
+        if mosaic:
+            return await download_and_encode_mosaic(
+                job, products, client, store, catalog, metrics, runner, downloads
+            )
+        return await download_and_encode(
+            job, product, client, store, catalog, metrics, runner
+        )
+    finally:
+        for each in (metrics, *downloads):
+            if metrics_directory:
+                each.dump(metrics_directory)
+            logger.info(f"{each.job}:\n{each.summary()}")
+
+
+def make_downloader(
+    job: Job,
+    product: settings.Product,
+    client: httpx.AsyncClient,
+    store: FrameStore | None,
+    catalog: FrameCatalog,
+    metrics: Metrics,
+    validator: FrameValidator | None,
+):
+    return Downloader(
+        client,
+        job.name,  # type: ignore
+        product,
+        job.start,
+        job.end,
+        num_workers=job.workers,
+        resume=job.resume,
+        filters=job.filters,
+        store=store if job.store else None,
+        catalog=catalog,
+        metrics=metrics,
+        validator=validator,
+    )
+
+
+async def download_and_encode(
+    job: Job,
+    product: settings.Product,
+    client: httpx.AsyncClient,
+    store: FrameStore | None,
+    catalog: FrameCatalog,
+    metrics: Metrics,
+    runner: FFmpegRunner | None = None,
+):
+    validator = FrameValidator() if job.validate else None
+    downloader = make_downloader(
+        job, product, client, store, catalog, metrics, validator
+    )
+    if not job.video:
+        await downloader.run()
+        return True
+
+    video = VideoMaker(
+        job.name,  # type: ignore
+        downloader.directory,
+        framerate=job.framerate,
+        segments=job.segments,
+        threads=job.threads,
+        gop=job.gop,
+        preprocess=job.preprocess,
+        metrics=metrics,
+        runner=runner,
+        timeout=job.encode_timeout,
+        profiles=job.output_profiles,
+    )
+    if job.pipeline:
+        code = await FramePipeline(video).run(downloader)
+    else:
+        await downloader.run()
+        video.frames, video.durations = await asyncio.to_thread(
+            frame_sequence,
+            downloader.directory,
+            job.framerate,
+            catalog,
+            validator,
+            job.hold_gaps,
+        )
+        encode = video.append_video if job.append else video.make_video
+        code = await encode()
+    if code != 0:
+        logger.error(f"ffmpeg exited with {code} while making {video.output}")
+        return False
+    logger.info(f"Made {', '.join(map(str, video.outputs))}")
+    return True
+
+
+async def download_and_encode_mosaic(
+    job: Job,
+    products: list[settings.Product],
+    client: httpx.AsyncClient,
+    store: FrameStore | None,
+    catalog: FrameCatalog,
+    metrics: Metrics,
+    runner: FFmpegRunner | None = None,
+    download_metrics: list[Metrics] | None = None,
+):
+    """
+    Downloads every product at the same time, on the job's client, and tiles them into one video by acquisition
+    time, see Timelapse.mosaic. Each download records into its entry of download_metrics (its own Metrics by
+    default), metrics only gets the encode.
+    """
+    if job.video:
+        if job.pipeline or job.append:
+            raise ValueError("Mosaics are encoded once every product is downloaded")
+        check_layout(job.tile, job.segments)
+    validator = FrameValidator() if job.validate else None
+    if download_metrics is None:
+        download_metrics = [Metrics(f"{job.name}-{p.path_string}") for p in products]
+    downloaders = [
+        make_downloader(job, product, client, store, catalog, each, validator)
+        for product, each in zip(products, download_metrics)
+    ]
+    downloads = [asyncio.create_task(downloader.run()) for downloader in downloaders]
+    try:
+        await asyncio.gather(*downloads)
+    except BaseException:
+        # don't leave the other products downloading into metrics that run_job is about to dump
+        for task in downloads:
+            task.cancel()
+        await asyncio.gather(*downloads, return_exceptions=True)
+        raise
+    if not job.video:
+        return True
+
+    directories = [downloader.directory for downloader in downloaders]
+    video = MosaicMaker(
+        job.name,  # type: ignore
+        directories,
+        framerate=job.framerate,
+        tile=job.tile,
+        columns=job.columns,
+        threads=job.threads,
+        gop=job.gop,
+        preprocess=job.preprocess,
+        metrics=metrics,
+        runner=runner,
+        timeout=job.encode_timeout,
+        profiles=job.output_profiles,
+    )
+    video.frames, video.durations = await asyncio.to_thread(
+        mosaic_sequence,
+        directories,
+        job.framerate,
+        catalog,
+        validator,
+        job.hold_gaps,
+    )
+    code = await video.make_video()
+    if code != 0:
+        logger.error(f"ffmpeg exited with {code} while making {video.output}")
+        return False
+    logger.info(f"Made {', '.join(map(str, video.outputs))}")
+    return True
+
+
+async def run_jobs(
+    jobs: list[Job],
+    tree: anytree.Node,
+    connections=32,
+    concurrent_jobs=4,
+    metrics_directory: pathlib.Path | None = METRICS_DIRECTORY,
+    cpus: int | None = None,
+    per_host: int | None = None,
+):
+    """
+    Runs the jobs concurrently, at most concurrent_jobs at a time. They share a single client, so connections caps
+    the connections open to MOSDAC across all of them no matter how many workers each job has, and per_host caps
+    the requests in flight to each host (useful with HTTP/2, where one connection carries many). Their encodes share
+    a budget of `cpus` cores (all of them by default) the same way. Returns how many jobs failed. The metrics of
+    each job are written to metrics_directory as <name>.json and <name>.prom.
+    """
+    products = {}
+    for job in jobs:
+        for path in job.products:
+            try:
+                products[path] = resolve_product(tree, path)
+            except (anytree.ResolverError, ValueError) as e:
+                logger.error(f"{job.name}: {e}")
+    runnable = [job for job in jobs if all(path in products for path in job.products)]
+
+    store = FrameStore()
+    catalog = FrameCatalog()
+    semaphore = asyncio.Semaphore(concurrent_jobs)
+    runner = FFmpegRunner(cpus)
+
+    async def run_one(job: Job):
+        async with semaphore:
+            try:
+                return await run_job(
+                    job,
+                    products[job.product],
+                    client,
+                    store,
+                    catalog,
+                    metrics_directory,
+                    runner,
+                    [products[path] for path in job.mosaic],
+                )
+            except Exception:
+                logger.exception(f"{job.name} failed")
+                return False
+
+    try:
+        async with make_client(
+            max_connections=connections, per_host=per_host
+        ) as client:
+            results = await asyncio.gather(*(run_one(job) for job in runnable))
+    finally:
+        catalog.commit()
+    return len(jobs) - sum(results)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m Timelapse",
+        description="Downloads frames from the MOSDAC gallery and makes timelapses of them, without the GUI.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="use the cached product catalog and don't check MOSDAC for a newer one",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=32,
+        help="connections to MOSDAC shared by every job (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        help="requests in flight to each MOSDAC host across every job (default: only --connections caps them)",
+    )
+    parser.add_argument(
+        "--cpus",
+        type=int,
+        help="cores the encodes of every job share between them (default: all of them)",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=pathlib.Path,
+        default=METRICS_DIRECTORY,
+        metavar="DIRECTORY",
+        help="where each job's metrics are written as JSON and a Prometheus textfile (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-metrics",
+        dest="metrics",
+        action="store_const",
+        const=None,
+        help="don't write metrics files",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("products", help="list the product paths")
+
+    batch = commands.add_parser("batch", help="run every job in a JSON job file")
+    batch.add_argument("jobs", type=pathlib.Path)
+    batch.add_argument(
+        "--jobs",
+        dest="concurrent_jobs",
+        type=int,
+        default=4,
+        help="jobs to run at the same time (default: %(default)s)",
+    )
+
+    run = commands.add_parser("run", help="download (and encode) a single range")
+    run.add_argument(
+        "product", help="e.g. 'INSAT-3D/IMAGER/Standard(Full Disk)/Shortwave Infrared'"
+    )
+    run.add_argument("start", help="YYYY-MM-DD or YYYY-MM-DDTHH:MM")
+    run.add_argument("end", help="YYYY-MM-DD (the whole day) or YYYY-MM-DDTHH:MM")
+    run.add_argument(
+        "--name", help="defaults to <start>_<end>, e.g. 21Jul2023_22Jul2023"
+    )
+    run.add_argument("--every-nth", type=int, default=1, help="keep every Nth frame")
+    run.add_argument(
+        "--one-per",
+        type=int,
+        default=0,
+        metavar="MINUTES",
+        help="keep one frame per N minutes",
+    )
+    run.add_argument(
+        "--hours",
+        type=int,
+        nargs=2,
+        default=(0, 24),
+        metavar=("FROM", "TO"),
+        help="hours of day (UTC)",
+    )
+    run.add_argument(
+        "--no-resume",
+        dest="resume",
+        action="store_false",
+        help="download every frame again",
+    )
+    run.add_argument(
+        "--no-store",
+        dest="store",
+        action="store_false",
+        help="don't share frames through ./Store",
+    )
+    run.add_argument("--workers", type=int, default=64)
+    run.add_argument(
+        "--no-video",
+        dest="video",
+        action="store_false",
+        help="only download the frames",
+    )
+    run.add_argument(
+        "--pipeline", action="store_true", help="encode the video while downloading"
+    )
+    run.add_argument(
+        "--append",
+        action="store_true",
+        help="only encode frames added since the last video of the same --name",
+    )
+    run.add_argument("--framerate", type=int, default=24)
+    run.add_argument(
+        "--segments", type=int, default=1, help="encode this many segments in parallel"
+    )
+    run.add_argument(
+        "--threads", type=int, default=0, help="x264 threads per encode (0 for auto)"
+    )
+    run.add_argument(
+        "--gop",
+        type=int,
+        default=250,
+        help="keyframe interval in frames, segments are whole GOPs so lower it for short videos",
+    )
+    run.add_argument(
+        "--crop",
+        type=int,
+        nargs=4,
+        metavar=("X", "Y", "WIDTH", "HEIGHT"),
+        help="crop the frames to this box (in pixels) before encoding",
+    )
+    run.add_argument("--width", type=int, help="scale the frames to this width")
+    run.add_argument("--height", type=int, help="scale the frames to this height")
+    run.add_argument(
+        "--stretch", action="store_true", help="stretch the contrast of every frame"
+    )
+    run.add_argument(
+        "--validate",
+        action="store_true",
+        help="re-download truncated, corrupt and blank frames, and leave them and duplicates out of the video",
+    )
+    run.add_argument(
+        "--hold-gaps",
+        action="store_true",
+        help="hold frames over missing ones so the video keeps to real time",
+    )
+    run.add_argument(
+        "--encode-timeout",
+        type=float,
+        metavar="SECONDS",
+        help="stop any ffmpeg process that runs for longer than this",
+    )
+    run.add_argument(
+        "--profiles",
+        nargs="+",
+        default=[],
+        choices=sorted(PROFILES),
+        help="make each of these outputs in a single pass instead of one mp4",
+    )
+    run.add_argument(
+        "--mosaic",
+        nargs="+",
+        default=[],
+        metavar="PRODUCT",
+        help="download these products as well and tile them next to the first one, aligned by time, in one video",
+    )
+    run.add_argument(
+        "--tile",
+        type=int,
+        nargs=2,
+        default=(720, 720),
+        metavar=("WIDTH", "HEIGHT"),
+        help="size of each product in a mosaic (default: 720 720)",
+    )
+    run.add_argument(
+        "--columns", type=int, help="tiles per row of a mosaic (default: about square)"
+    )
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    for name in ("asyncio", "httpcore", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    tree = settings.make_settings_tree(offline=args.offline)
+    if args.command == "products":
+        for node in anytree.PreOrderIter(tree):
+            if isinstance(node, settings.Product):
+                print(node.path_string)
+        return 0
+
+    try:
+        if args.command == "batch":
+            jobs = load_jobs(args.jobs)
+            concurrent_jobs = args.concurrent_jobs
+        else:
+            fields = {field.name for field in dataclasses.fields(Job)}
+            jobs = [Job(**{k: v for k, v in vars(args).items() if k in fields})]
+            concurrent_jobs = 1
+    except ValueError as e:
+        logger.error(e)
+        return 1
+
+    failed = asyncio.run(
+        run_jobs(
+            jobs,
+            tree,
+            args.connections,
+            concurrent_jobs,
+            args.metrics,
+            args.cpus,
+            args.per_host,
+        )
+    )
+    if failed:
+        logger.error(f"{failed} of {len(jobs)} jobs failed")
+        return 1
+    return 0
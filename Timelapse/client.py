@@ -0,0 +1,122 @@
+import asyncio
+import functools
+import importlib.util
+import logging
+import time
+
+import httpx
+
+logger = logging.getLogger("Timelapse.Client")
+
+MAX_CONNECTIONS = 32
+KEEPALIVE_EXPIRY = 60.0
+TIMEOUT = httpx.Timeout(30.0, connect=10.0, pool=None)
+
+
+def http2_available():
+    """HTTP/2 needs the optional h2 package (pip install httpx[http2]), without it everything is HTTP/1.1."""
+    return importlib.util.find_spec("h2") is not None
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that gives its host slot back once it has been read or closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self.stream = stream
+        self.release = release
+        self.released = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if not self.released:
+                self.released = True
+                self.release()
+
+
+class PerHostLimitTransport(httpx.AsyncBaseTransport):
+    """
+    Caps the requests in flight to any single host at per_host, on top of the pool's overall limits. With HTTP/2
+    a single connection carries many requests at once, so the connection limit alone no longer bounds how hard
+    one server gets hit. A request holds its slot until its response body is closed, not just until the headers
+    arrive, because that's when the server is done with it.
+
+    The time the slot was acquired is put in the response's extensions as "slot_acquired" (a time.perf_counter()
+    value), so callers can tell time spent waiting here apart from the server's latency.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, per_host: int):
+        self.transport = transport
+        self.per_host = per_host
+        self.slots: dict[str, asyncio.Semaphore] = {}
+
+    async def handle_async_request(self, request: httpx.Request):
+        host = request.url.host
+        slots = self.slots.setdefault(host, asyncio.Semaphore(self.per_host))
+        await slots.acquire()
+        acquired = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            slots.release()
+            raise
+        response.extensions["slot_acquired"] = acquired
+        if isinstance(response.stream, httpx.ByteStream):
+            # the body is already in memory (mocked transports), there is nothing left to wait for
+            slots.release()
+        else:
+            response.stream = _ReleasingStream(response.stream, slots.release)  # type: ignore
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def make_client(
+    max_connections=MAX_CONNECTIONS,
+    per_host: int | None = None,
+    keepalive_expiry=KEEPALIVE_EXPIRY,
+    http2: bool | None = None,
+    timeout: httpx.Timeout = TIMEOUT,
+):
+    """
+    The AsyncClient every MOSDAC request should go through. Make one per process (or per event loop) and pass it
+    around, so concurrent jobs share its pool and reuse connections instead of each doing their own TLS handshakes.
+
+    max_connections caps the pool across all hosts and every connection is kept alive for keepalive_expiry seconds
+    once idle. per_host caps the requests in flight to each host, by default only max_connections does. http2=None
+    uses HTTP/2 when h2 is installed. The default timeout never gives up waiting for a free connection, so callers
+    queue on the pool rather than fail when many jobs run at once.
+    """
+    if http2 is None:
+        http2 = http2_available()
+    elif http2 and not http2_available():
+        logger.warning("h2 is not installed, falling back to HTTP/1.1")
+        http2 = False
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    transport = httpx.AsyncHTTPTransport(limits=limits, http2=http2)
+    if per_host:
+        transport = PerHostLimitTransport(transport, per_host)
+    logger.debug(
+        f"HTTP client: {max_connections} connections, {per_host} per host, HTTP/{'2' if http2 else '1.1'}"
+    )
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+@functools.cache
+def sync_client():
+    """The blocking client for the few calls made outside of an event loop, such as fetching the product catalog."""
+    return httpx.Client(
+        timeout=TIMEOUT,
+        http2=http2_available(),
+        limits=httpx.Limits(keepalive_expiry=KEEPALIVE_EXPIRY),
+    )
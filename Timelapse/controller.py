@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger("Timelapse.Controller")
+
+
+class ConcurrencyController:
+    """
+    Limits the number of requests in flight and moves that limit around AIMD style, the same way TCP does with its
+    congestion window:
+
+    - every successful request adds increase / limit, so the limit grows by roughly `increase` per round trip
+    - a 429, a 5xx, a timeout or a latency that is `latency_tolerance` times worse than the best one seen so far
+      multiplies the limit by `decrease`, at most once per round trip so that one burst of errors counts once
+
+    Use it as an async context manager around each request, and report how the request went with on_success() or
+    on_congestion().
+    """
+
+    def __init__(
+        self,
+        initial=8,
+        minimum=1,
+        maximum=64,
+        increase=1.0,
+        decrease=0.5,
+        latency_tolerance=3.0,
+    ):
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+
+        self.in_flight = 0
+        self.base_latency = None
+        self.smoothed_latency = None
+        self.last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency
+        else:
+            self.smoothed_latency = 0.8 * self.smoothed_latency + 0.2 * latency
+
+        if self.smoothed_latency > self.base_latency * self.latency_tolerance:
+            self.on_congestion()
+        else:
+            self._set_limit(self.limit + self.increase / self.limit)
+
+    def on_congestion(self):
+        now = time.monotonic()
+        if now - self.last_decrease < (self.smoothed_latency or 0.0):
+            return
+        self.last_decrease = now
+        self._set_limit(self.limit * self.decrease)
+
+    def _set_limit(self, limit: float):
+        old = int(self.limit)
+        self.limit = min(max(limit, self.minimum), self.maximum)
+        if int(self.limit) != old:
+            logger.debug(f"Concurrency limit {old} -> {int(self.limit)}")
+            if int(self.limit) > old:
+                asyncio.ensure_future(self._wake())
+
+    async def _wake(self):
+        async with self._condition:
+            self._condition.notify_all()
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed request gets another go, and how long to wait before it does. Delays are exponential
+    with full jitter: a random value between 0 and min(max_delay, base_delay * 2 ** attempt). Each frame gets at
+    most max_attempts tries, and the whole run can retry at most `budget` times (None for no run wide limit), so a
+    dead server doesn't keep a job alive forever.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, budget=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.retries = 0
+
+    def should_retry(self, attempts: int):
+        if attempts >= self.max_attempts:
+            return False
+        if self.budget is not None and self.retries >= self.budget:
+            return False
+        return True
+
+    def delay(self, attempts: int, retry_after: str | None = None):
+        self.retries += 1
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempts))
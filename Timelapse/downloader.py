@@ -1,23 +1,56 @@
 import asyncio
+import functools
+import hashlib
 import logging
+import math
+import os
 import pathlib
+import time
+import typing
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import httpx
 from aiofile import async_open
 
 from . import settings
+from .catalog import FrameCatalog
+from .controller import ConcurrencyController, RetryPolicy
+from .manifest import Manifest, file_checksum
+from .metrics import Metrics
+from .sampling import FrameFilter, parse_timestamp
+from .store import FrameStore
+from .validation import FrameValidator
 
 logger = logging.getLogger("Timelapse.Downloader")
 
 MOSDAC_STRING = "https://mosdac.gov.in/look/"
+GET_IMAGE_URL = "https://www.mosdac.gov.in/gallery/getImage.php"
+# how many more urls than the cadence suggests a discovery request asks for, for days with extra acquisitions
+DISCOVERY_MARGIN = 1.5
 
 
-def prepare_directories(name: str):
+class TruncatedDownload(Exception):
+    pass
+
+
+class BadFrame(Exception):
+    pass
+
+
+class RetryableStatus(Exception):
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"{response.status_code} {response.reason_phrase}")
+        self.retry_after = response.headers.get("Retry-After")
+
+
+def prepare_directories(name: str, resume=False):
     images = pathlib.Path(f"./Images/{name}")
     if images.exists():
-        logger.warning(f"{images} already exists! Files will be overwritten")
+        if resume:
+            logger.info(f"{images} already exists, resuming")
+        else:
+            logger.warning(f"{images} already exists! Files will be overwritten")
     else:
         images.mkdir(parents=True)
 
@@ -29,15 +62,36 @@ def prepare_directories(name: str):
     logger.info("Folders Created!")
 
 
+def date_windows(start: datetime, end: datetime, days: int):
+    """
+    Splits the dates from start to end (both inclusive) into consecutive windows of at most `days` days, returned
+    as (first day, last day) pairs.
+    """
+    first = datetime(start.year, start.month, start.day)
+    last = datetime(end.year, end.month, end.day)
+    windows = []
+    while first <= last:
+        window_end = min(first + timedelta(days=days - 1), last)
+        windows.append((first, window_end))
+        first = window_end + timedelta(days=1)
+    return windows
+
+
 @dataclass
 class ImageURL:
     url_suffix: str
     image_number: int
+    attempts: int = 0
 
     @property
     def url(self):
         return MOSDAC_STRING + self.url_suffix
 
+    @functools.cached_property
+    def timestamp(self) -> datetime | None:
+        """Acquisition time (UTC) from the file name, None if the name doesn't have one."""
+        return parse_timestamp(self.url_suffix)
+
 
 class Downloader:
     """
@@ -47,7 +101,41 @@ class Downloader:
     - a worker function that keeps running .download_and_write_one_image() till it's task is cancelled.
     - .download_and_write_one_image() takes one ImageURL from the queue and does what the name suggests.
 
-    The whole program is IO heavy so GET requests and writing to disk are done asynchronously.
+    The whole program is IO heavy so GET requests and writing to disk are done asynchronously. Image bodies are
+    streamed to a .part file in chunks of chunk_size bytes and renamed into place once the last byte is written, so
+    memory use stays around chunk_size * num_workers and an interrupted run never leaves a partial N.jpg behind.
+
+    With resume=True every frame is recorded in a manifest.json next to the images. Frames that the manifest says
+    are complete and whose file still has the recorded size are skipped without touching the network, everything else
+    is fetched again. verify_checksums=True also re-hashes the files on disk before trusting them, and revalidate=True
+    sends the intact frames to MOSDAC as conditional requests (ETag / Last-Modified) instead of skipping them outright.
+
+    num_workers is the most requests that will ever be in flight. How many actually are is decided by a
+    ConcurrencyController, which backs off when MOSDAC starts returning 429s, 5xxs, timeouts or slowing down and
+    creeps back up when it doesn't. Frames that fail that way, or with a network error, go back on the queue after a
+    jittered exponential backoff decided by the RetryPolicy. 404s are not retried.
+
+    Only frames whose acquisition time lies between start_date and end_date (both inclusive, to the minute) are
+    downloaded, further thinned out by `filters` (see Timelapse.sampling) before they are numbered and queued.
+    `cadence` is the expected time between two frames of the product (the product's own by default), it is only
+    used to size discovery requests.
+
+    Given a FrameStore, frames that some earlier run already downloaded are linked in from the store instead of
+    being fetched, and every new download is added to the store for the runs after this one.
+
+    on_frame, if given, is called once for every queued frame as soon as it is settled: with its path when the
+    image is on disk, or with None when it could not be downloaded. Frames settle in whatever order the network
+    finishes them.
+
+    Given a FrameCatalog, every settled frame is recorded in it as well, complete or failed.
+
+    Request latencies, bytes, retries, 404s, disk write times, queue depth and worker utilization go into
+    `metrics` (a fresh Metrics named after the run if none is given).
+
+    Given a FrameValidator, every downloaded image is checked before it counts as complete. Truncated, undecodable
+    and blank images are deleted and retried like any other failed download, and intact frames from an earlier run
+    that fail the check are fetched again. So are frames whose copy in the store fails it, the bad copy is removed
+    from the store.
     """
 
     def __init__(
@@ -57,7 +145,22 @@ class Downloader:
         product: settings.Product,
         start_date: datetime,
         end_date: datetime,
-        num_workers=25,
+        num_workers=64,
+        resume=False,
+        verify_checksums=False,
+        revalidate=False,
+        chunk_size=64 * 1024,
+        controller: ConcurrencyController | None = None,
+        retry_policy: RetryPolicy | None = None,
+        window_days=1,
+        discovery_concurrency=8,
+        filters: list[FrameFilter] | None = None,
+        cadence: timedelta | None = None,
+        store: FrameStore | None = None,
+        on_frame: typing.Callable[[ImageURL, pathlib.Path | None], None] | None = None,
+        catalog: FrameCatalog | None = None,
+        metrics: Metrics | None = None,
+        validator: FrameValidator | None = None,
     ):
         self.client = client
 
@@ -67,28 +170,125 @@ class Downloader:
         self.end_date = end_date
         self.url_queue = asyncio.Queue()
         self.num_workers = num_workers
+        self.controller = controller or ConcurrencyController(
+            initial=min(16, num_workers), maximum=num_workers
+        )
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_tasks: set[asyncio.Task] = set()
+        self.window_days = window_days
+        self.discovery_concurrency = discovery_concurrency
+        self.filters = filters or []
+        self.cadence = cadence or product.cadence
+        self.store = store
+        self.on_frame = on_frame
+        self.catalog = catalog
+        self.metrics = metrics or Metrics(name)
+        self.metrics.workers = num_workers
+        self.validator = validator
 
         self.total_urls = 0
-        prepare_directories(f"{self.product.path_string}/{self.name}")
+        self.resume = resume
+        self.verify_checksums = verify_checksums
+        self.revalidate = revalidate
+        self.chunk_size = chunk_size
+        self.directory = pathlib.Path(
+            f"./Images/{self.product.path_string}/{self.name}"
+        )
+        prepare_directories(f"{self.product.path_string}/{self.name}", resume)
+        self.manifest = Manifest(self.directory) if resume else None
 
-    def get_urls(self):
+    async def get_urls(self):
         """
         Fills up self.url_queue with ImageURLs. The urls are received from
         https://www.mosdac.gov.in/gallery/getImage.php which needs an `st_date` parameter that is the *last* date of
-        the images, and a `count` parameter for the number of image URLs, this counts *back* from the end date,
-        the number of images per day is inconsistent, we overestimate the `count` and filter out the urls that lie
-        outside the desired time frame.
+        the images, and a `count` parameter for the number of image URLs, this counts *back* from the end date.
+        The number of images per day is inconsistent, so `count` is what the cadence suggests plus DISCOVERY_MARGIN,
+        and a window that comes back full without reaching its first day is asked for again with twice the count.
+        Urls that lie outside the desired time frame are filtered out afterwards.
+
+        Instead of asking for the whole range at once the range is split into windows of window_days days which are
+        requested concurrently (at most discovery_concurrency at a time) on self.client. Windows are put on the
+        queue in date order as soon as they and every window before them have arrived, so the workers can get going
+        while the rest of the range is still being discovered.
         """
 
         logger.info("Getting URLs!")
-        start_time = self.start_date.strftime("%Y-%m-%d").upper()
-        end_time = self.end_date.strftime("%Y-%m-%d")
+        windows = date_windows(self.start_date, self.end_date, self.window_days)
+        logger.debug(f"Discovering URLs in {len(windows)} windows")
+        limit = asyncio.Semaphore(self.discovery_concurrency)
+        tasks = [
+            asyncio.create_task(self.get_window(first, last, limit))
+            for first, last in windows
+        ]
+
+        seen = set()
+        try:
+            for task in tasks:
+                for suffix in await task:
+                    if suffix in seen:
+                        continue
+                    seen.add(suffix)
+                    url = ImageURL(suffix, self.total_urls + 1)
+                    if not self.wanted(url):
+                        continue
+                    self.total_urls += 1
+                    self.url_queue.put_nowait(url)
+        finally:
+            for task in tasks:
+                task.cancel()
+        logger.info(f"Found {self.total_urls} images")
 
-        if self.end_date == self.start_date:
-            count = 48
-        else:
-            count = (self.end_date - self.start_date).total_seconds() / 1800
+    def progress(self):
+        """
+        (frames settled, frames found so far, bytes downloaded), it can be polled from another thread while the
+        download runs.
+        """
+        return (
+            self.metrics.value("frames_settled"),
+            self.total_urls,
+            self.metrics.value("bytes_downloaded"),
+        )
+
+    def wanted(self, url: ImageURL):
+        timestamp = url.timestamp
+        if timestamp is None:
+            logger.debug(f"No timestamp in {url.url_suffix}, keeping it")
+            return True
+        if not self.start_date <= timestamp <= self.end_date:
+            return False
+        return all(rule.accept(timestamp) for rule in self.filters)
+
+    async def get_window(
+        self, first: datetime, last: datetime, limit: asyncio.Semaphore
+    ) -> list[str]:
+        start_time = first.strftime("%Y-%m-%d").upper()
+        end_time = last.strftime("%Y-%m-%d")
+        # st_date counts back from the end of the last day, so the count has to reach back to the start of the
+        # window, or to the start of the range if that is later.
+        earliest = max(first, self.start_date)
+        span = last + timedelta(days=1) - earliest
+        count = math.ceil(span / self.cadence * DISCOVERY_MARGIN)
 
+        while True:
+            urls = await self.request_urls(start_time, end_time, count, limit)
+            if len(urls) < count:
+                break
+            timestamp = parse_timestamp(urls[0])
+            if timestamp is None or timestamp <= earliest:
+                break
+            logger.debug(f"{count} urls don't reach back to {earliest}, asking again")
+            count *= 2
+
+        index = next(
+            (i for i, url in enumerate(urls) if start_time in url.upper()), None
+        )
+        logger.debug(f"Index of start date: {index}")
+        return urls[index or 0 :]
+
+    async def request_urls(
+        self, start_time: str, end_time: str, count: int, limit: asyncio.Semaphore
+    ):
+        """The last `count` urls up to the end of end_time, oldest first, empty if the request failed."""
         json = {
             "prod": self.product.pattern,
             "st_date": end_time,
@@ -99,26 +299,21 @@ class Downloader:
         )
 
         try:
-            data = httpx.post(
-                "https://www.mosdac.gov.in/gallery/getImage.php", json=json
-            ).json()[0]
+            async with limit:
+                response = await self.client.post(GET_IMAGE_URL, json=json)
+            data = response.json()[0]
         except httpx.ConnectError as e:
             logger.error(f"{e}. Check your internet connection.")
-            return
+            return []
         except httpx.TimeoutException as e:
             logger.error(f"{e}. Check your internet connection or try again later")
-            return
+            return []
+        except (httpx.HTTPError, ValueError, IndexError) as e:
+            logger.error(f"Could not get URLs for {start_time} to {end_time}: {e}")
+            return []
 
         logger.debug(f"Length of URL Data Received: {len(data)}")
-
-        index = data.find(start_time)
-        logger.debug(f"Index of start date: {index}")
-        index = 0 if index == -1 else index
-        data = data[index:]
-
-        for index, url in enumerate(data.split(",")):
-            self.url_queue.put_nowait(ImageURL(url, index + 1))
-        self.total_urls = index + 1
+        return [url for url in data.split(",") if url]
 
     async def worker(self):
         while True:
@@ -127,63 +322,269 @@ class Downloader:
             except asyncio.CancelledError:
                 return
 
+    def file_path(self, url: ImageURL):
+        return self.directory / f"{url.image_number}.{self.product.pattern[-3:]}"
+
+    def stored_path(self, url: ImageURL):
+        if self.store is None or url.timestamp is None:
+            return None
+        return self.store.path_for(
+            self.product, url.timestamp, self.product.pattern[-3:]
+        )
+
+    async def link_from_store(
+        self, url: ImageURL, stored: pathlib.Path, file_path: pathlib.Path
+    ):
+        if not self.store.link_into(stored, file_path):  # type: ignore
+            return False
+        if not await self.is_valid(file_path):
+            # the stored copy is as bad as the frame it replaced, drop both so the frame is downloaded again
+            file_path.unlink(missing_ok=True)
+            stored.unlink(missing_ok=True)
+            return False
+        logger.debug(f"Linked image {file_path.name} from {stored}")
+        self.metrics.inc("store_hits")
+        if self.manifest:
+            checksum = await asyncio.to_thread(file_checksum, file_path)
+            self.manifest.update(
+                file_path.name,
+                url.url,
+                size=file_path.stat().st_size,
+                checksum=checksum,
+                status="complete",
+            )
+        return True
+
+    def conditional_headers(self, key: str, url: ImageURL):
+        entry = self.manifest.get(key) if self.manifest else None
+        if entry is None or entry.url != url.url:
+            return {}
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    async def stream_to_file(self, response: httpx.Response, file_path: pathlib.Path):
+        """
+        Writes the body of a streaming response to file_path.part and renames it to file_path when complete. Returns
+        the size and sha256 of what was written. The .part file is removed if anything goes wrong.
+        """
+        temp_path = file_path.with_name(file_path.name + ".part")
+        digest = hashlib.sha256()
+        size = 0
+        writing = 0.0
+        try:
+            async with async_open(temp_path, "wb") as file:
+                async for chunk in response.aiter_bytes(self.chunk_size):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    self.metrics.inc("bytes_downloaded", len(chunk))
+                    start = time.perf_counter()
+                    await file.write(chunk)
+                    writing += time.perf_counter() - start
+            self.metrics.observe("disk_write_seconds", writing)
+            expected = response.headers.get("Content-Length")
+            encoded = "Content-Encoding" in response.headers
+            if expected is not None and not encoded and int(expected) != size:
+                raise TruncatedDownload(f"got {size} of {expected} bytes")
+            os.replace(temp_path, file_path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return size, digest.hexdigest()
+
     async def download_and_write_one_image(self):
         url: ImageURL = await self.url_queue.get()
+        self.metrics.set("queue_depth", self.url_queue.qsize())
+        self.metrics.set("concurrency_limit", self.controller.limit)
+        self.metrics.worker_started()
         logger.debug(f"Working on image {url.image_number}/{self.total_urls}")
+        file_path = self.file_path(url)
+        key = file_path.name
+        stored = self.stored_path(url)
+        headers = {}
+        retrying = False
+        on_disk = False
         try:
-            response = await self.client.get(url.url)
-            if response.status_code != 200:
+            if (
+                self.manifest
+                and await self.is_intact(key, url, file_path)
+                and await self.is_valid(file_path)
+            ):
+                if not self.revalidate:
+                    logger.debug(f"Skipping intact image {key}")
+                    self.metrics.inc("skipped")
+                    on_disk = True
+                    return
+                headers = self.conditional_headers(key, url)
+            elif stored and await self.link_from_store(url, stored, file_path):
+                on_disk = True
+                return
+
+            async with self.controller:
+                on_disk = await self.fetch(url, file_path, headers, stored)
+        except (
+            RetryableStatus,
+            TruncatedDownload,
+            BadFrame,
+            httpx.TransportError,
+        ) as exc:
+            if isinstance(exc, (RetryableStatus, httpx.TimeoutException)):
+                self.controller.on_congestion()
+            retrying = self.retry(url, exc)
+            if not retrying and self.manifest:
+                self.manifest.update(key, url.url, status="failed")
+        except Exception as exc:
+            logger.warning(f"{exc.__class__.__name__} while working on {url.url}")
+            if self.manifest:
+                self.manifest.update(key, url.url, status="failed")
+        finally:
+            self.metrics.worker_finished()
+            if not retrying:
+                if self.catalog:
+                    self.catalog_frame(url, file_path, on_disk)
+                if self.on_frame:
+                    self.on_frame(url, file_path if on_disk else None)
+                self.metrics.inc("frames_settled")
+                if not on_disk:
+                    self.metrics.inc("frames_failed")
+                self.url_queue.task_done()
+
+    async def fetch(
+        self,
+        url: ImageURL,
+        file_path: pathlib.Path,
+        headers: dict,
+        stored: pathlib.Path | None = None,
+    ):
+        """Downloads one image, returns True if it ended up on disk."""
+        key = file_path.name
+        on_disk = False
+        start = time.perf_counter()
+        async with self.client.stream("GET", url.url, headers=headers) as response:
+            # waiting for a per host slot is our own queueing, not the server slowing down
+            latency = time.perf_counter() - response.extensions.get(
+                "slot_acquired", start
+            )
+            self.metrics.inc("requests")
+            self.metrics.observe("request_latency_seconds", latency)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RetryableStatus(response)
+
+            if response.status_code == 304:
+                logger.debug(f"Image {key} not modified")
+                self.metrics.inc("skipped")
+                on_disk = True
+            elif response.status_code != 200:
                 error_message = (
                     f"{response.status_code} {response.reason_phrase} - {url.url}"
                 )
                 if response.status_code == 404:
+                    self.metrics.inc("not_found")
                     logger.warning(error_message)
                 else:
                     logger.error(error_message)
+                if self.manifest:
+                    self.manifest.update(key, url.url, status="failed")
             else:
-                file_path = pathlib.Path(
-                    f"./Images/{self.product.path_string}/{self.name}/{url.image_number}.{self.product.pattern[-3:]}"
-                )
-                async with async_open(file_path, "wb") as file:
-                    await file.write(response.content)
-        except Exception as exc:
-            logger.warning(f"{exc.__class__.__name__} while working on {url.url}")
+                size, checksum = await self.stream_to_file(response, file_path)
+                if not await self.is_valid(file_path):
+                    file_path.unlink()
+                    raise BadFrame(key)
+                if stored:
+                    self.store.add(file_path, stored)  # type: ignore
+                if self.manifest:
+                    self.manifest.update(
+                        key,
+                        url.url,
+                        size=size,
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                        checksum=checksum,
+                        status="complete",
+                    )
+                on_disk = True
+        self.controller.on_success(latency)
+        return on_disk
+
+    async def is_intact(self, key: str, url: ImageURL, file_path: pathlib.Path):
+        """Manifest.is_intact, on a thread when verify_checksums means reading the whole file back."""
+        if self.verify_checksums:
+            return await asyncio.to_thread(
+                self.manifest.is_intact, key, url.url, file_path, True  # type: ignore
+            )
+        return self.manifest.is_intact(key, url.url, file_path)  # type: ignore
+
+    async def is_valid(self, file_path: pathlib.Path):
+        if self.validator is None:
+            return True
+        report = await asyncio.to_thread(self.validator.inspect, file_path)
+        problem = self.validator.problem(report)
+        if problem:
+            logger.warning(f"Image {file_path.name} is {problem}")
+            self.metrics.inc(f"frames_{problem}")
+        return problem is None
+
+    def catalog_frame(self, url: ImageURL, file_path: pathlib.Path, on_disk: bool):
+        entry = self.manifest.get(file_path.name) if self.manifest else None
+        stat = file_path.stat() if on_disk else None
+        self.catalog.record(  # type: ignore
+            file_path,
+            self.product.path_string,
+            self.name,
+            url.image_number,
+            url.timestamp,
+            "complete" if on_disk else "failed",
+            size=stat.st_size if stat else None,
+            hash=entry.checksum if entry else None,
+            mtime=stat.st_mtime if stat else None,
+        )
+
+    def retry(self, url: ImageURL, exc: Exception):
+        """
+        Puts url back on the queue after a backoff, returns False if it has run out of attempts. The queue item is
+        only marked done once it has been re-queued, so url_queue.join() keeps waiting for it in the meantime.
+        """
+        url.attempts += 1
+        reason = f"{exc.__class__.__name__} {exc}".strip()
+        if not self.retry_policy.should_retry(url.attempts):
+            logger.error(
+                f"Giving up on {url.url} after {url.attempts} attempts: {reason}"
+            )
+            return False
+        self.metrics.inc("retries")
+        delay = self.retry_policy.delay(url.attempts, getattr(exc, "retry_after", None))
+        logger.debug(f"Retrying {url.url} in {delay:.1f}s ({reason})")
+        task = asyncio.create_task(self.requeue(url, delay))
+        self.retry_tasks.add(task)
+        task.add_done_callback(self.retry_tasks.discard)
+        return True
+
+    async def requeue(self, url: ImageURL, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            self.url_queue.put_nowait(url)
         finally:
             self.url_queue.task_done()
 
     async def run(self):
-        self.get_urls()
         workers = [asyncio.create_task(self.worker()) for _ in range(self.num_workers)]
-        await self.url_queue.join()
-        for worker in workers:
-            worker.cancel()
-
-
-async def test(product: settings.Product):
-    async with httpx.AsyncClient() as client:
-        start = datetime(2023, 7, 21)
-        end = datetime(2023, 7, 22)
-        downloader = Downloader(client, "Test", product, start, end)
-        await downloader.run()
-
-
-if __name__ == "__main__":
-    import time
-
-    import anytree
-
-    logging.basicConfig(level=logging.DEBUG)
-    logging.getLogger("asyncio").setLevel(logging.WARNING)
-    logging.getLogger("httpcore").setLevel(logging.WARNING)
-    logging.getLogger("httpx").setLevel(logging.WARNING)
-
-    resolver = anytree.Resolver()
-    path = "/Settings/INSAT-3D/IMAGER/Standard(Full Disk)/Shortwave Infrared"
-    settings_tree = settings.make_settings_tree()
-    prod = resolver.get(settings_tree, path)
-
-    a = time.perf_counter()
-    asyncio.run(test(prod))
-    delta = time.perf_counter() - a
-
-    print(f"Completed in {delta} seconds")
+        try:
+            await self.get_urls()
+            await self.url_queue.join()
+        finally:
+            for task in workers + list(self.retry_tasks):
+                task.cancel()
+            if self.manifest:
+                self.manifest.save()
+            if self.validator:
+                self.validator.save(self.directory)
+            if self.catalog:
+                self.catalog.commit()
+        if skipped := self.metrics.value("skipped"):
+            logger.info(f"Skipped {skipped} images that were already downloaded")
+        if store_hits := self.metrics.value("store_hits"):
+            logger.info(f"Linked {store_hits} images from {self.store.root}")  # type: ignore
+        logger.debug(f"{self.name}:\n{self.metrics.summary()}")
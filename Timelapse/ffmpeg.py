@@ -0,0 +1,172 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import os
+import typing
+from dataclasses import dataclass
+
+logger = logging.getLogger("Timelapse.FFmpeg")
+
+
+def _number(value: str | None, suffix=""):
+    """ffmpeg writes N/A for what it doesn't know yet."""
+    if value is None:
+        return None
+    value = value.strip().removesuffix(suffix)
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+@dataclass
+class FFmpegProgress:
+    """
+    One block of `-progress` output. bitrate is in kbit/s, size is the bytes written so far and out_time the seconds
+    of output encoded. total_frames is what the caller said to expect, if anything.
+    """
+
+    frame: int
+    fps: float
+    speed: float | None
+    bitrate: float | None
+    size: int | None
+    out_time: float | None
+    total_frames: int | None
+    done: bool
+
+    @classmethod
+    def parse(cls, block: dict[str, str], total_frames: int | None = None):
+        size = _number(block.get("total_size"))
+        out_time = _number(block.get("out_time_us"))
+        return cls(
+            frame=int(_number(block.get("frame")) or 0),
+            fps=_number(block.get("fps")) or 0.0,
+            speed=_number(block.get("speed"), "x"),
+            bitrate=_number(block.get("bitrate"), "kbits/s"),
+            size=int(size) if size is not None else None,
+            out_time=out_time / 1e6 if out_time is not None else None,
+            total_frames=total_frames,
+            done=block.get("progress") == "end",
+        )
+
+    @property
+    def eta(self):
+        """Seconds left at the current fps, None without a total or before the first frame."""
+        if not self.total_frames or self.fps <= 0:
+            return None
+        return max(self.total_frames - self.frame, 0) / self.fps
+
+
+class FFmpegRunner:
+    """
+    Runs ffmpeg processes on the event loop and turns their `-progress` output into FFmpegProgress events.
+
+    Every process reserves `cost` cores out of a budget of `cores` (all of them by default) for as long as it runs,
+    and waits for them to free up before it starts, so encodes from several jobs share the machine instead of all
+    starting at once. A cost of 0 runs outside the budget, for processes that mostly wait on their input. Make one
+    per event loop and hand it to every VideoMaker.
+
+    Cancelling the task awaiting run() kills the process, and so does running out of `timeout`.
+    """
+
+    def __init__(self, cores: int | None = None):
+        self.cores = cores or os.cpu_count() or 1
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, cost: int):
+        if cost <= 0:
+            yield
+            return
+        # a process that wants more than the whole budget gets the whole budget, rather than never starting
+        cost = min(cost, self.cores)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used + cost <= self.cores)
+            self.used += cost
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.used -= cost
+                self._condition.notify_all()
+
+    async def run(
+        self,
+        args: list[str],
+        cost=1,
+        total_frames: int | None = None,
+        on_progress: typing.Callable[[FFmpegProgress], None] | None = None,
+        timeout: float | None = None,
+        feed: typing.Callable[[asyncio.StreamWriter], typing.Awaitable] | None = None,
+    ):
+        """
+        Runs ffmpeg with `args` (starting with the executable) and returns its exit code. feed, if given, is awaited
+        with the process's stdin and should write the input to it, stdin is closed when it returns. Whatever ffmpeg
+        writes to stderr is logged if it fails.
+        """
+        async with self.reserve(cost):
+            process = await asyncio.create_subprocess_exec(
+                args[0],
+                "-nostats",
+                "-progress",
+                "pipe:1",
+                *args[1:],
+                stdin=asyncio.subprocess.PIPE if feed else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            errors: collections.deque[str] = collections.deque(maxlen=20)
+            try:
+                code = await asyncio.wait_for(
+                    self._communicate(process, total_frames, on_progress, feed, errors),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                logger.error(f"ffmpeg took longer than {timeout} seconds, stopping it")
+                code = None
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        if code is None:
+            code = process.returncode
+        if code != 0 and errors:
+            logger.error("\n".join(errors))
+        return code
+
+    async def _communicate(
+        self,
+        process: asyncio.subprocess.Process,
+        total_frames: int | None,
+        on_progress,
+        feed,
+        errors: collections.deque,
+    ):
+        async def read_progress():
+            block = {}
+            async for line in process.stdout:  # type: ignore
+                key, _, value = line.decode(errors="replace").strip().partition("=")
+                block[key] = value
+                if key == "progress":
+                    if on_progress:
+                        on_progress(FFmpegProgress.parse(block, total_frames))
+                    block = {}
+
+        async def read_errors():
+            async for line in process.stderr:  # type: ignore
+                errors.append(line.decode(errors="replace").rstrip())
+
+        async def write_input():
+            try:
+                await feed(process.stdin)
+            finally:
+                process.stdin.close()  # type: ignore
+
+        tasks = [read_progress(), read_errors()]
+        if feed:
+            tasks.append(write_input())
+        await asyncio.gather(*tasks)
+        return await process.wait()
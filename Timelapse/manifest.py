@@ -0,0 +1,100 @@
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import pathlib
+from dataclasses import dataclass
+
+logger = logging.getLogger("Timelapse.Manifest")
+
+MANIFEST_NAME = "manifest.json"
+
+
+@dataclass
+class ManifestEntry:
+    url: str
+    size: int | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    checksum: str | None = None
+    status: str = "pending"
+
+    @property
+    def complete(self):
+        return self.status == "complete"
+
+
+def file_checksum(path: pathlib.Path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Keeps track of every frame a run has tried to download, keyed by file name, so that a later run over the same
+    directory can tell which frames are already on disk and intact.
+
+    It lives next to the frames as manifest.json. Writes go to a temporary file that is renamed over the old one, a
+    crash while saving leaves the previous manifest behind instead of a half written one.
+    """
+
+    def __init__(self, directory: pathlib.Path, save_every=50):
+        self.path = directory / MANIFEST_NAME
+        self.save_every = save_every
+        self.entries: dict[str, ManifestEntry] = {}
+        self._unsaved = 0
+
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text())
+                self.entries = {
+                    key: ManifestEntry(**value) for key, value in data.items()
+                }
+                logger.debug(f"Loaded {len(self.entries)} entries from {self.path}")
+            except (json.JSONDecodeError, TypeError) as e:
+                logger.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def update(self, key: str, url: str, **fields):
+        entry = self.entries.get(key)
+        if entry is None or entry.url != url:
+            entry = ManifestEntry(url)
+            self.entries[key] = entry
+        for name, value in fields.items():
+            setattr(entry, name, value)
+
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def is_intact(self, key: str, url: str, file_path: pathlib.Path, verify=False):
+        """
+        A frame is intact if the manifest says it was completely downloaded from the same url and the file on disk
+        still has the recorded size. With verify=True the checksum is recomputed as well, which means reading the
+        whole file back.
+        """
+        entry = self.entries.get(key)
+        if entry is None or not entry.complete or entry.url != url:
+            return False
+        try:
+            size = file_path.stat().st_size
+        except FileNotFoundError:
+            return False
+        if size != entry.size:
+            return False
+        if verify and entry.checksum != file_checksum(file_path):
+            return False
+        return True
+
+    def save(self):
+        data = {key: dataclasses.asdict(entry) for key, entry in self.entries.items()}
+        temp = self.path.with_suffix(".tmp")
+        temp.write_text(json.dumps(data, indent=1))
+        os.replace(temp, self.path)
+        self._unsaved = 0
@@ -0,0 +1,230 @@
+import bisect
+import collections
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import re
+import threading
+import time
+
+logger = logging.getLogger("Timelapse.Metrics")
+
+METRICS_DIRECTORY = pathlib.Path("./Metrics")
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DISK_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+
+class Histogram:
+    """Counts of observations at or below each bucket bound, the last count is everything above the last bound."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float):
+        """Upper bound of the bucket the q-th quantile falls in, None without observations."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict(zip(map(str, self.buckets), self.counts)),
+            "over": self.counts[-1],
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms of one job. They are updated from the event loop (or the encode threads) and
+    read from the GUI thread, so every access takes a lock. It's never contended for long enough to matter.
+
+    Worker utilization is the time workers spent busy over the time they could have been, tracked by
+    worker_started() and worker_finished() around each unit of work.
+    """
+
+    def __init__(self, job: str):
+        self.job = job
+        self.started = time.time()
+        self.counters: collections.Counter[str] = collections.Counter()
+        self.gauges: dict[str, float] = {}
+        self.histograms = {
+            "request_latency_seconds": Histogram(LATENCY_BUCKETS),
+            "disk_write_seconds": Histogram(DISK_BUCKETS),
+        }
+        self.workers = 0
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self._busy_since = time.monotonic()
+        self._monotonic_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def value(self, name: str):
+        with self._lock:
+            return self.counters[name]
+
+    def set(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def _account_busy(self, now: float):
+        self.busy_seconds += self.busy * (now - self._busy_since)
+        self._busy_since = now
+
+    def worker_started(self):
+        with self._lock:
+            self._account_busy(time.monotonic())
+            self.busy += 1
+
+    def worker_finished(self):
+        with self._lock:
+            self._account_busy(time.monotonic())
+            self.busy -= 1
+
+    def snapshot(self):
+        """Everything as plain JSON types, along with the rates derived from it."""
+        with self._lock:
+            now = time.monotonic()
+            self._account_busy(now)
+            elapsed = now - self._monotonic_start
+            counters = dict(self.counters)
+            return {
+                "job": self.job,
+                "started": self.started,
+                "elapsed_seconds": elapsed,
+                "counters": counters,
+                "gauges": {
+                    **self.gauges,
+                    "busy_workers": self.busy,
+                    "workers": self.workers,
+                },
+                "rates": {
+                    "bytes_per_second": counters.get("bytes_downloaded", 0) / elapsed
+                    if elapsed
+                    else 0.0,
+                    "requests_per_second": counters.get("requests", 0) / elapsed
+                    if elapsed
+                    else 0.0,
+                    "worker_utilization": self.busy_seconds / (self.workers * elapsed)
+                    if self.workers and elapsed
+                    else 0.0,
+                },
+                "histograms": {
+                    name: histogram.snapshot()
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def summary(self):
+        """A few lines for a tooltip or a log message."""
+        s = self.snapshot()
+        counters, gauges, rates = s["counters"], s["gauges"], s["rates"]
+        latency = s["histograms"]["request_latency_seconds"]
+        if not gauges["workers"]:
+            lines = []
+        else:
+            lines = [
+                f"requests {counters.get('requests', 0)}  retries {counters.get('retries', 0)}  "
+                f"404s {counters.get('not_found', 0)}  failed {counters.get('frames_failed', 0)}",
+                f"{rates['bytes_per_second'] / 1024 / 1024:.2f} MB/s  "
+                f"{rates['requests_per_second']:.1f} req/s  "
+                f"workers {gauges['busy_workers']}/{gauges['workers']} "
+                f"({rates['worker_utilization']:.0%} busy)",
+            ]
+        if latency["count"]:
+            lines.append(
+                f"latency p50 <= {latency['p50']}s  p90 <= {latency['p90']}s  p99 <= {latency['p99']}s"
+            )
+        if "queue_depth" in gauges:
+            lines.append(f"queue {gauges['queue_depth']:.0f}")
+        if "encode_fps" in gauges:
+            lines.append(
+                f"encode {gauges['encode_fps']:.1f} fps  {gauges.get('encode_speed', 0):.2f}x"
+            )
+        return "\n".join(lines)
+
+    def to_prometheus(self, prefix="timelapse"):
+        """The snapshot in the Prometheus text exposition format, labelled with the job name."""
+        s = self.snapshot()
+        job = self.job.replace("\\", "\\\\").replace('"', '\\"')
+        label = f'job="{job}"'
+        lines = []
+
+        def metric(name, kind, value):
+            name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{name}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name}{{{label}}} {value}")
+
+        for name, value in s["counters"].items():
+            metric(f"{name}_total", "counter", value)
+        for name, value in s["gauges"].items():
+            metric(name, "gauge", value)
+        for name, value in s["rates"].items():
+            metric(name, "gauge", value)
+        metric("elapsed_seconds", "gauge", s["elapsed_seconds"])
+        for name, histogram in s["histograms"].items():
+            full = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}_{name}")
+            lines.append(f"# TYPE {full} histogram")
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f'{full}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{full}_bucket{{{label},le="+Inf"}} {histogram["count"]}')
+            lines.append(f"{full}_sum{{{label}}} {histogram['sum']}")
+            lines.append(f"{full}_count{{{label}}} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, directory: pathlib.Path = METRICS_DIRECTORY):
+        """
+        Writes <job>.json and <job>.prom (for node_exporter's textfile collector) into directory, each through a
+        temporary file so a scraper never reads half of one.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = re.sub(r"[^\w.-]", "_", self.job)
+        for suffix, text in (
+            (".json", json.dumps(self.snapshot(), indent=1)),
+            (".prom", self.to_prometheus()),
+        ):
+            path = directory / f"{stem}{suffix}"
+            temp = path.with_name(path.name + ".tmp")
+            temp.write_text(text)
+            os.replace(temp, path)
+        logger.debug(f"Wrote metrics of {self.job} to {directory}")
+
+
+@contextlib.contextmanager
+def log_duration(log: logging.Logger, what: str):
+    """Logs how long the body took at DEBUG, for one-off timings that don't belong to a job."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        log.debug(f"{what} in {time.perf_counter() - start:.3f} seconds")
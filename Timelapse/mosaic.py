@@ -0,0 +1,208 @@
+import bisect
+import contextlib
+import logging
+import math
+import pathlib
+from datetime import datetime, timedelta
+
+from .catalog import FrameCatalog
+from .sequence import hold_durations, timed_frames
+from .validation import FrameValidator
+from .video import OutputProfile, VideoMaker
+
+logger = logging.getLogger("Timelapse.Mosaic")
+
+
+def median_cadence(timestamps: list[datetime]):
+    intervals = sorted(b - a for a, b in zip(timestamps, timestamps[1:]) if b > a)
+    if not intervals:
+        return None
+    return intervals[len(intervals) // 2]
+
+
+def nearest(timestamps: list[datetime], moment: datetime):
+    """Index of the timestamp closest to moment, the earlier one on a tie. timestamps must be sorted."""
+    index = bisect.bisect_left(timestamps, moment)
+    if index == 0:
+        return 0
+    if index == len(timestamps):
+        return index - 1
+    before, after = timestamps[index - 1], timestamps[index]
+    return index - 1 if moment - before <= after - moment else index
+
+
+def align_timestamps(
+    timelines: list[dict[pathlib.Path, datetime]], tolerance: timedelta | None = None
+):
+    """
+    Lines up the frames of several products by acquisition time, returned as (slot times, rows) where every row has
+    one frame per product, in the order of timelines.
+
+    Every acquisition time of every product opens a slot, unless it's within `tolerance` of the slot before it (by
+    default half the shortest cadence of any product), so products on the same schedule that are a few minutes
+    apart share their slots. A product with no frame in a slot is filled in with its frame nearest to the slot.
+    """
+    ordered = []
+    for timeline in timelines:
+        frames = sorted(timeline, key=timeline.__getitem__)
+        ordered.append((frames, [timeline[frame] for frame in frames]))
+
+    if tolerance is None:
+        cadences = [median_cadence(timestamps) for _, timestamps in ordered]
+        known = [cadence for cadence in cadences if cadence is not None]
+        tolerance = min(known) / 2 if known else timedelta(0)
+
+    slots: list[datetime] = []
+    for timestamp in sorted(t for _, timestamps in ordered for t in timestamps):
+        if not slots or timestamp - slots[-1] > tolerance:
+            slots.append(timestamp)
+
+    rows = []
+    filled = 0
+    for slot in slots:
+        row = []
+        for frames, timestamps in ordered:
+            index = nearest(timestamps, slot)
+            if abs(timestamps[index] - slot) > tolerance:
+                filled += 1
+            row.append(frames[index])
+        rows.append(tuple(row))
+    if filled:
+        logger.info(f"Filled in {filled} missing tiles with the nearest frame")
+    return slots, rows
+
+
+def mosaic_sequence(
+    directories: list[pathlib.Path],
+    framerate: int,
+    catalog: FrameCatalog | None = None,
+    validator: FrameValidator | None = None,
+    hold_gaps=False,
+    max_hold: int | None = None,
+    tolerance: timedelta | None = None,
+):
+    """
+    (rows, durations) for a MosaicMaker, the mosaic version of Timelapse.sequence.frame_sequence: the runs in
+    `directories` aligned by align_timestamps, without the frames the validator flags. Frames without a timestamp
+    can't be aligned and are left out.
+    """
+    timelines = []
+    for directory in directories:
+        sequence = timed_frames(directory, catalog)
+        frames = list(sequence)
+        if validator:
+            frames, _ = validator.select(frames)
+        timeline = {
+            frame: sequence[frame] for frame in frames if sequence[frame] is not None
+        }
+        if len(timeline) < len(frames):
+            logger.warning(
+                f"Leaving out {len(frames) - len(timeline)} frames of {directory} without a timestamp"
+            )
+        if not timeline:
+            raise ValueError(f"No frames with a timestamp in {directory}")
+        timelines.append(timeline)
+
+    slots, rows = align_timestamps(timelines, tolerance)
+    durations = hold_durations(slots, framerate, max_hold) if hold_gaps else None  # type: ignore
+    return rows, durations
+
+
+def check_layout(tile: tuple[int, int], segments=1):
+    """Raises ValueError for settings MosaicMaker can't make a mosaic with, so they can be caught before a download."""
+    if segments > 1:
+        raise ValueError("Mosaics are made in one pass, not in segments")
+    width, height = tile
+    if width <= 0 or height <= 0 or width % 2 or height % 2:
+        raise ValueError(f"Tiles should have an even width and height, not {tile}")
+
+
+class MosaicMaker(VideoMaker):
+    """
+    A VideoMaker that tiles the runs in `directories` into a grid, left to right and top to bottom, `columns` wide
+    (about square by default), and encodes the grid in a single ffmpeg process.
+
+    frames is a list of rows with one frame per directory (see mosaic_sequence), by default every frame with a
+    timestamp aligned by acquisition time. Every directory is read through its own ffconcat script with the same
+    durations, preprocessed, and fitted into a tile of `tile` (width, height) pixels, letterboxed if the aspect
+    ratios differ. Output profiles work the same way as for a single run. Segments, append_video and
+    make_video_from_stream don't, a mosaic is made in one pass once every product is on disk.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        directories: list[pathlib.Path],
+        framerate=24,
+        tile: tuple[int, int] = (720, 720),
+        columns: int | None = None,
+        **kwargs,
+    ):
+        super().__init__(name, directories[0], framerate, **kwargs)
+        check_layout(tile, self.segments)
+        self.directories = directories
+        self.tile = tuple(tile)
+        self.columns = columns or math.ceil(math.sqrt(len(directories)))
+
+    def default_frames(self):
+        rows, _ = mosaic_sequence(self.directories, self.framerate)
+        return rows
+
+    @property
+    def layout(self):
+        """xstack positions of the tiles, in pixels."""
+        width, height = self.tile
+        return [
+            f"{index % self.columns * width}_{index // self.columns * height}"
+            for index in range(len(self.directories))
+        ]
+
+    def tile_filters(self):
+        width, height = self.tile
+        return [
+            *self.filters(),
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease:flags=area",
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2",
+            "setsar=1",
+        ]
+
+    @contextlib.contextmanager
+    def input_args(
+        self, frames: list[tuple[pathlib.Path, ...]], durations: list[float]
+    ):
+        """One ffconcat input per directory, made from its column of the rows."""
+        with contextlib.ExitStack() as stack:
+            args = []
+            for column in zip(*frames):
+                args += stack.enter_context(super().input_args(list(column), durations))
+            yield args
+
+    def output_args(self):
+        count = len(self.directories)
+        chain = ",".join(self.tile_filters())
+        graph = [f"[{i}:v]{chain}[t{i}]" for i in range(count)]
+        if count > 1:
+            tiles = "".join(f"[t{i}]" for i in range(count))
+            layout = "|".join(self.layout)
+            graph.append(f"{tiles}xstack=inputs={count}:layout={layout}:fill=black[m]")
+            source = "[m]"
+        else:
+            source = "[t0]"
+        if self.profiles:
+            return self.split_args(graph, source)
+        codec = OutputProfile("video").codec_args(self.gop, self.threads)
+        return [
+            "-filter_complex",
+            ";".join(graph),
+            "-map",
+            source,
+            *codec,
+            "-y",
+            f"./{self.output}",
+        ]
+
+    async def append_video(self):
+        raise ValueError("Mosaics can't be appended to, use make_video")
+
+    async def make_video_from_stream(self, frames):
+        raise ValueError("Mosaics can't be made from a stream, use make_video")
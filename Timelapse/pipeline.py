@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import pathlib
+
+from .downloader import Downloader, ImageURL
+from .video import VideoMaker
+
+logger = logging.getLogger("Timelapse.Pipeline")
+
+
+class FramePipeline:
+    """
+    Encodes a video while its frames are still downloading.
+
+    The Downloader settles frames in whatever order the network finishes them. They are held in a reorder buffer
+    (image number -> path, so it only ever holds paths, never image data) until every frame before them has settled.
+    The contiguous prefix is then handed to VideoMaker.make_video_from_stream in order. Frames that could not be
+    downloaded are skipped rather than stalling the stream. Total time comes out close to the longer of the download
+    and the encode instead of their sum.
+    """
+
+    def __init__(self, video: VideoMaker):
+        self.video = video
+        self.next_number = 1
+        self.pending: dict[int, pathlib.Path | None] = {}
+        self.ready: asyncio.Queue[pathlib.Path | None] = asyncio.Queue()
+
+    def frame_done(self, url: ImageURL, path: pathlib.Path | None):
+        self.pending[url.image_number] = path
+        while self.next_number in self.pending:
+            path = self.pending.pop(self.next_number)
+            self.next_number += 1
+            if path is not None:
+                self.ready.put_nowait(path)
+
+    def flush(self):
+        """Sends whatever is left in the reorder buffer, in order, and ends the stream."""
+        for number in sorted(self.pending):
+            path = self.pending.pop(number)
+            if path is not None:
+                self.ready.put_nowait(path)
+        self.ready.put_nowait(None)
+
+    async def frames(self):
+        while (path := await self.ready.get()) is not None:
+            yield path
+
+    async def run(self, downloader: Downloader):
+        downloader.on_frame = self.frame_done
+        encode = asyncio.create_task(self.video.make_video_from_stream(self.frames()))
+        try:
+            await downloader.run()
+        except BaseException:
+            encode.cancel()
+            raise
+        self.flush()
+        return await encode
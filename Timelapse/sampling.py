@@ -0,0 +1,72 @@
+import re
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+# MOSDAC file names carry the acquisition time, e.g. 3DIMG_21JUL2023_0000_L1C_SIR.jpg
+TIMESTAMP_PATTERN = re.compile(r"(\d{2}[A-Za-z]{3}\d{4})_(\d{4})")
+
+
+def parse_timestamp(url: str) -> datetime | None:
+    """Acquisition time (UTC) from the file name at the end of a MOSDAC url, None if it doesn't have one."""
+    match = TIMESTAMP_PATTERN.search(url.rsplit("/", 1)[-1])
+    if match is None:
+        return None
+    try:
+        return datetime.strptime("".join(match.groups()), "%d%b%Y%H%M")
+    except ValueError:
+        return None
+
+
+class FrameFilter:
+    """
+    Rules for thinning out the frames of a download before any of them are queued. Every rule looks at the
+    acquisition timestamp of a frame (UTC, parsed from the MOSDAC file name) and says whether to keep it. The
+    Downloader applies its rules in order and a frame has to pass all of them. Frames reach the rules in
+    chronological order, which is what lets EveryNth and OnePer keep state.
+    """
+
+    def accept(self, timestamp: datetime) -> bool:
+        raise NotImplementedError
+
+
+@dataclass
+class EveryNth(FrameFilter):
+    """Keeps the 1st, (n+1)th, (2n+1)th ... frame that reaches this rule."""
+
+    n: int
+    _seen: int = field(default=0, init=False, repr=False)
+
+    def accept(self, timestamp: datetime) -> bool:
+        keep = self._seen % self.n == 0
+        self._seen += 1
+        return keep
+
+
+@dataclass
+class TimeOfDay(FrameFilter):
+    """Keeps frames taken between start and end (inclusive). A window like 18:00-06:00 wraps around midnight."""
+
+    start: time
+    end: time
+
+    def accept(self, timestamp: datetime) -> bool:
+        t = timestamp.time()
+        if self.start <= self.end:
+            return self.start <= t <= self.end
+        return t >= self.start or t <= self.end
+
+
+@dataclass
+class OnePer(FrameFilter):
+    """Keeps the first frame of every `interval` long slot, slots that divide a day evenly start at midnight."""
+
+    interval: timedelta
+    _last_slot: int | None = field(default=None, init=False, repr=False)
+
+    def accept(self, timestamp: datetime) -> bool:
+        slot = (timestamp - EPOCH) // self.interval
+        if slot == self._last_slot:
+            return False
+        self._last_slot = slot
+        return True
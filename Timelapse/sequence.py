@@ -0,0 +1,110 @@
+import logging
+import pathlib
+from datetime import datetime
+
+from .catalog import FrameCatalog, split_run_directory
+from .manifest import MANIFEST_NAME, Manifest
+from .sampling import parse_timestamp
+from .validation import FrameValidator
+from .video import numbered_frames
+
+logger = logging.getLogger("Timelapse.Sequence")
+
+
+def manifest_timestamps(directory: pathlib.Path):
+    """File name -> acquisition time of every frame the run's manifest knows the url of."""
+    if not (directory / MANIFEST_NAME).exists():
+        return {}
+    timestamps = {}
+    for name, entry in Manifest(directory).entries.items():
+        timestamp = parse_timestamp(entry.url)
+        if timestamp is not None:
+            timestamps[name] = timestamp
+    return timestamps
+
+
+def catalog_timestamps(catalog: FrameCatalog, directory: pathlib.Path):
+    """File name -> acquisition time of every frame of the run in the catalog, empty for directories outside it."""
+    try:
+        product, run = split_run_directory(directory)
+    except ValueError:
+        return {}
+    return {
+        pathlib.Path(row["path"]).name: datetime.fromisoformat(row["timestamp"])
+        for row in catalog.frames(product, run)
+        if row["timestamp"]
+    }
+
+
+def timed_frames(directory: pathlib.Path, catalog: FrameCatalog | None = None):
+    """
+    Every frame on disk in directory, keyed by path, with its acquisition time (None if nothing records one), in
+    chronological order. Timestamps come from the catalog if there is one and from the run's manifest otherwise.
+    Missing frame numbers are simply not there, frames without a timestamp go last in frame number order.
+    """
+    timestamps = catalog_timestamps(catalog, directory) if catalog else {}
+    if not timestamps:
+        timestamps = manifest_timestamps(directory)
+    frames = numbered_frames(directory)
+    frames.sort(
+        key=lambda path: (
+            path.name not in timestamps,
+            timestamps.get(path.name, datetime.min),
+        )
+    )
+    return {path: timestamps.get(path.name) for path in frames}
+
+
+def hold_durations(
+    timestamps: list[datetime | None], framerate: int, max_hold: int | None = None
+):
+    """
+    Seconds to show each frame for so the video keeps to real time. A frame is held for as many video frames as
+    cadences (the median time between two frames) pass before the next one, so a missing frame, or a missing day,
+    shows up as a pause instead of a jump. max_hold caps how many video frames one frame is held for. Frames
+    without a timestamp, and the last frame, are shown for a single video frame.
+    """
+    step = 1 / framerate
+    known = [timestamp for timestamp in timestamps if timestamp is not None]
+    intervals = sorted(b - a for a, b in zip(known, known[1:]) if b > a)
+    if not intervals:
+        return [step] * len(timestamps)
+    cadence = intervals[len(intervals) // 2]
+
+    durations = []
+    for current, following in zip(timestamps, [*timestamps[1:], None]):
+        holds = 1
+        if current is not None and following is not None and following > current:
+            holds = max(1, round((following - current) / cadence))
+        if max_hold:
+            holds = min(holds, max_hold)
+        durations.append(holds * step)
+    return durations
+
+
+def frame_sequence(
+    directory: pathlib.Path,
+    framerate: int,
+    catalog: FrameCatalog | None = None,
+    validator: FrameValidator | None = None,
+    hold_gaps=False,
+    max_hold: int | None = None,
+):
+    """
+    (frames, durations) for a VideoMaker: the frames of a run in chronological order, without the ones the
+    validator flags, and with hold_gaps the duration of each (None otherwise). Frames left out by the validator
+    count as gaps too, the frame before them is held in their place.
+    """
+    sequence = timed_frames(directory, catalog)
+    frames = list(sequence)
+    if validator:
+        frames, _ = validator.select(frames)
+    durations = None
+    if hold_gaps:
+        durations = hold_durations(
+            [sequence[frame] for frame in frames], framerate, max_hold
+        )
+        held = round(sum(durations) * framerate) - len(frames)
+        if held:
+            logger.info(f"Holding frames over gaps for {held} extra video frames")
+    return frames, durations
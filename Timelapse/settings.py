@@ -1,10 +1,24 @@
+import json
 import logging
+import os
+import pathlib
+import threading
+import time
+from datetime import timedelta
 
 import anytree
 import httpx
 
+from .client import sync_client
+
 logger = logging.getLogger("Timelapse.Products")
 
+PRODUCT_URL = "https://www.mosdac.gov.in/gallery/product.json?v=0.4"
+CATALOG_CACHE = pathlib.Path("./Cache/product.json")
+CATALOG_MAX_AGE = 24 * 60 * 60
+# the usual time between two frames of a product, MOSDAC doesn't publish it per product
+DEFAULT_CADENCE = timedelta(minutes=30)
+
 
 class Product(anytree.Node):
     """
@@ -12,20 +26,70 @@ class Product(anytree.Node):
     idk just felt like it needed to be its own thing ¯\\_(ツ)_/¯
     """
 
-    def __init__(self, *args, pattern: str, **kwargs):
+    def __init__(self, *args, pattern: str, cadence=DEFAULT_CADENCE, **kwargs):
         super().__init__(*args, **kwargs)
         self.pattern = pattern
+        self.cadence = cadence
 
     @property
     def path_string(self):
         return "/".join(node.name for node in self.path[1:])  # type: ignore
 
 
-def get_product_dict():
+def load_cached_catalog():
+    """
+    The cache is the raw product.json from MOSDAC along with the ETag and Last-Modified headers it came with and
+    the time it was fetched (or last confirmed unchanged), returns None if there is no usable cache.
+    """
+    try:
+        return json.loads(CATALOG_CACHE.read_text())
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError as e:
+        logger.warning(f"Ignoring unreadable catalog cache {CATALOG_CACHE}: {e}")
+        return None
+
+
+def save_cached_catalog(cache: dict):
+    CATALOG_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    temp = CATALOG_CACHE.with_suffix(".tmp")
+    temp.write_text(json.dumps(cache))
+    os.replace(temp, CATALOG_CACHE)
+
+
+def refresh_catalog(cache: dict | None = None):
+    """
+    Fetches product.json with a conditional request against the cached copy and updates the cache. Returns the new
+    cache, or None if MOSDAC could not be reached.
+    """
+    headers = {}
+    if cache:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+
     logger.info("GET-ting json of product types...")
-    product_url = "https://www.mosdac.gov.in/gallery/product.json?v=0.4"
-    response = httpx.get(url=product_url)
-    return response.json()
+    try:
+        response = sync_client().get(PRODUCT_URL, headers=headers)
+        if response.status_code == 304 and cache:
+            logger.debug("Product catalog unchanged")
+            cache["fetched"] = time.time()
+        else:
+            response.raise_for_status()
+            cache = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched": time.time(),
+                "products": response.json(),
+            }
+            logger.debug("Product catalog updated")
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error(f"Could not refresh the product catalog: {e}")
+        return None
+
+    save_cached_catalog(cache)
+    return cache
 
 
 def parse_dict_into_tree(dictionary: dict, parent: anytree.Node):
@@ -91,9 +155,29 @@ def parse_dict_into_tree(dictionary: dict, parent: anytree.Node):
             parse_dict_into_tree(value, parent=new_parent_node)
 
 
-def make_settings_tree():
+def make_settings_tree(offline=False, max_age=CATALOG_MAX_AGE):
+    """
+    Builds the tree from the cached catalog if there is one, so startup doesn't wait on MOSDAC. A cache older than
+    max_age seconds is refreshed on a background thread, which updates the cache for the next launch. Without a
+    cache the catalog is fetched before returning. offline=True never touches the network, and gives an empty tree
+    if nothing has been cached yet.
+    """
+    cache = load_cached_catalog()
+    if cache is None:
+        if offline:
+            logger.error(f"Offline and no product catalog cached at {CATALOG_CACHE}")
+        else:
+            cache = refresh_catalog()
+    elif not offline and time.time() - cache.get("fetched", 0) > max_age:
+        logger.debug("Product catalog cache is stale, refreshing in the background")
+        threading.Thread(target=refresh_catalog, args=(cache,), daemon=True).start()
+
+    products = cache["products"] if cache else []
+    return build_settings_tree(products)
+
+
+def build_settings_tree(products: list):
     settings = anytree.Node("Settings")
-    products = get_product_dict()
     logger.debug("Building settings tree for:")
     for satellite in products:
         logger.debug(f"\t{satellite['sat']}")
@@ -0,0 +1,80 @@
+import logging
+import os
+import pathlib
+import shutil
+import uuid
+from datetime import datetime
+
+from . import settings
+
+logger = logging.getLogger("Timelapse.Store")
+
+STORE_ROOT = pathlib.Path("./Store")
+
+
+def temp_path(path: pathlib.Path, suffix: str):
+    """A name next to path that no other job will pick, so concurrent jobs linking the same frame don't collide."""
+    return path.with_name(f"{path.name}.{uuid.uuid4().hex}{suffix}")
+
+
+class FrameStore:
+    """
+    One copy of every frame ever downloaded, shared by all runs. A MOSDAC frame never changes once published, so
+    the product and acquisition time are enough to address it:
+
+        ./Store/<product path>/<YYYY-MM-DD>/<YYYY-MM-DD_HHMM>.jpg
+
+    Run directories (./Images/<product>/<name>/N.jpg) are populated with hard links into the store, falling back
+    to symlinks where hard links aren't possible (e.g. the store is on another filesystem) or when symlinks=True.
+    Overlapping runs then cost no extra bandwidth, and no extra disk either with hard links.
+    """
+
+    def __init__(self, root: pathlib.Path = STORE_ROOT, symlinks=False):
+        self.root = root
+        self.symlinks = symlinks
+
+    def path_for(self, product: settings.Product, timestamp: datetime, extension: str):
+        return (
+            self.root
+            / product.path_string
+            / f"{timestamp:%Y-%m-%d}"
+            / f"{timestamp:%Y-%m-%d_%H%M}.{extension}"
+        )
+
+    def link_into(self, stored: pathlib.Path, destination: pathlib.Path):
+        """Points destination at stored, replacing whatever was at destination. Returns False if stored is missing."""
+        if not stored.exists():
+            return False
+        temp = temp_path(destination, ".link")
+        try:
+            if self.symlinks:
+                temp.symlink_to(stored.resolve())
+            else:
+                try:
+                    os.link(stored, temp)
+                except OSError:
+                    temp.symlink_to(stored.resolve())
+            os.replace(temp, destination)
+        finally:
+            temp.unlink(missing_ok=True)
+        return True
+
+    def add(self, source: pathlib.Path, stored: pathlib.Path):
+        """
+        Puts a freshly downloaded file in the store, as a hard link to it where possible. Otherwise the file is
+        copied into the store and replaced by a symlink to the copy.
+        """
+        stored.parent.mkdir(parents=True, exist_ok=True)
+        temp = temp_path(stored, ".tmp")
+        try:
+            try:
+                os.link(source, temp)
+                linked = True
+            except OSError:
+                shutil.copyfile(source, temp)
+                linked = False
+            os.replace(temp, stored)
+        finally:
+            temp.unlink(missing_ok=True)
+        if self.symlinks or not linked:
+            self.link_into(stored, source)
@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import pathlib
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .store import temp_path
+
+logger = logging.getLogger("Timelapse.Thumbnails")
+
+THUMBNAIL_DIRECTORY = ".thumbs"
+LEVELS = (256, 1024)
+
+
+class ThumbnailCache:
+    """
+    Downscaled copies of frames, generated once and kept next to them:
+
+        <run>/.thumbs/256/N.jpg
+        <run>/.thumbs/1024/N.jpg
+        <run>/.thumbs/index.json  <- size and mtime of each frame when its thumbnails were made
+
+    A level is the width of the thumbnail (frames narrower than that are not scaled up). Every level of a frame is
+    made by one ffmpeg process so the frame is decoded once. A frame whose size or mtime no longer matches the
+    index is stale, and get() hands back the original until ensure() has regenerated it.
+    """
+
+    def __init__(self, levels=LEVELS, workers: int | None = None):
+        self.levels = sorted(levels)
+        self.workers = workers or os.cpu_count() or 1
+        self._indexes: dict[pathlib.Path, dict] = {}
+        self._lock = threading.Lock()
+
+    def thumbnail_path(self, frame: pathlib.Path, level: int):
+        return frame.parent / THUMBNAIL_DIRECTORY / str(level) / f"{frame.stem}.jpg"
+
+    def _index(self, directory: pathlib.Path):
+        with self._lock:
+            if directory not in self._indexes:
+                path = directory / THUMBNAIL_DIRECTORY / "index.json"
+                try:
+                    self._indexes[directory] = json.loads(path.read_text())
+                except (FileNotFoundError, json.JSONDecodeError):
+                    self._indexes[directory] = {}
+            return self._indexes[directory]
+
+    def is_fresh(self, frame: pathlib.Path):
+        try:
+            stat = frame.stat()
+        except FileNotFoundError:
+            return False
+        return self._index(frame.parent).get(frame.name) == [
+            stat.st_size,
+            stat.st_mtime,
+        ]
+
+    def get(self, frame: pathlib.Path, level: int | None):
+        """The thumbnail of frame at level, or frame itself for level None or if the thumbnail is stale."""
+        if level is None or not self.is_fresh(frame):
+            return frame
+        return self.thumbnail_path(frame, level)
+
+    def level_for(self, width: float):
+        """Smallest level at least `width` pixels wide, None (the original) if none is."""
+        for level in self.levels:
+            if level >= width:
+                return level
+        return None
+
+    def generate(self, frame: pathlib.Path):
+        """
+        Makes every level of frame. ffmpeg writes to temporary names that are moved into place once it's done, so
+        a reader (or another ensure() making the same thumbnails) never sees a half written one.
+        """
+        stat = frame.stat()
+        outputs = []
+        temps = {}
+        graph = [
+            f"[0:v]split={len(self.levels)}"
+            + "".join(f"[s{i}]" for i in range(len(self.levels)))
+        ]
+        for i, level in enumerate(self.levels):
+            path = self.thumbnail_path(frame, level)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temps[path] = temp_path(path, ".jpg")
+            graph.append(f"[s{i}]scale='min({level},iw)':-2[t{i}]")
+            outputs += ["-map", f"[t{i}]", "-y", str(temps[path])]
+        args = [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-i",
+            str(frame),
+            "-filter_complex",
+            ";".join(graph),
+            *outputs,
+        ]
+        try:
+            if subprocess.run(args).returncode != 0:
+                logger.warning(f"Could not make thumbnails of {frame}")
+                return False
+            for path, temp in temps.items():
+                os.replace(temp, path)
+        finally:
+            for temp in temps.values():
+                temp.unlink(missing_ok=True)
+        index = self._index(frame.parent)
+        with self._lock:
+            index[frame.name] = [stat.st_size, stat.st_mtime]
+        return True
+
+    def ensure(self, frames: list[pathlib.Path]):
+        """Generates thumbnails for every frame in `frames` that doesn't have fresh ones, returns how many."""
+        stale = [frame for frame in frames if not self.is_fresh(frame)]
+        if not stale:
+            return 0
+        logger.debug(f"Making thumbnails of {len(stale)} frames")
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            made = sum(pool.map(self.generate, stale))
+        for directory in {frame.parent for frame in stale}:
+            self.save(directory)
+        return made
+
+    def save(self, directory: pathlib.Path):
+        index = self._index(directory)
+        path = directory / THUMBNAIL_DIRECTORY / "index.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = temp_path(path, ".tmp")
+        with self._lock:
+            temp.write_text(json.dumps(index))
+            os.replace(temp, path)
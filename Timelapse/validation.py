@@ -0,0 +1,213 @@
+import collections
+import json
+import logging
+import os
+import pathlib
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+logger = logging.getLogger("Timelapse.Validation")
+
+VALIDATION_INDEX = ".validation.json"
+HASH_SIZE = 16
+# the last bytes of a complete file, an EOI marker can't show up inside JPEG data so finding one near the end is enough
+TRAILERS = {
+    ".jpg": b"\xff\xd9",
+    ".jpeg": b"\xff\xd9",
+    ".png": b"IEND\xaeB`\x82",
+}
+
+
+def has_trailer(path: pathlib.Path):
+    """False if the file ends before its format's end marker (a truncated download), True for unknown formats."""
+    trailer = TRAILERS.get(path.suffix.lower())
+    if trailer is None:
+        return True
+    with open(path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        file.seek(max(0, file.tell() - 64))
+        return trailer in file.read()
+
+
+def sample(path: pathlib.Path, width: int, height: int):
+    """The frame decoded and shrunk to width x height grey pixels, None if ffmpeg can't decode it."""
+    args = [
+        "ffmpeg",
+        "-loglevel",
+        "error",
+        "-xerror",
+        "-i",
+        str(path),
+        "-frames:v",
+        "1",
+        "-vf",
+        f"scale={width}:{height}:flags=area,format=gray",
+        "-f",
+        "rawvideo",
+        "-",
+    ]
+    result = subprocess.run(args, capture_output=True)
+    if result.returncode != 0 or len(result.stdout) != width * height:
+        return None
+    return result.stdout
+
+
+def difference_hash(pixels: bytes, size=HASH_SIZE):
+    """
+    dHash of a (size + 1) x size grey image: one bit per pair of horizontal neighbours, set where the brightness
+    goes up. Re-encoded or slightly noisy copies of a frame hash to (almost) the same bits.
+    """
+    value = 0
+    for row in range(size):
+        line = pixels[row * (size + 1) : (row + 1) * (size + 1)]
+        for left, right in zip(line, line[1:]):
+            value = value << 1 | (right > left)
+    return value
+
+
+@dataclass
+class FrameReport:
+    """What the validator measured on a frame. mean, variance and hash are None if it could not be decoded."""
+
+    path: pathlib.Path
+    complete: bool
+    mean: float | None = None
+    variance: float | None = None
+    hash: int | None = None
+
+
+class FrameValidator:
+    """
+    Finds the frames that shouldn't make it into a video: truncated files (no JPEG EOI / PNG IEND at the end), files
+    ffmpeg can't decode, blank frames (mean brightness below black_level or variance below min_variance, on a 0-255
+    scale, which catches all black frames and flat placeholder images) and duplicates (a difference hash within
+    duplicate_distance bits of the last frame kept, out of HASH_SIZE * HASH_SIZE).
+
+    Every frame is decoded once, to a tiny greyscale copy, and the measurements are cached next to the frames:
+
+        <run>/.validation.json  <- name: [size, mtime, complete, mean, variance, hash]
+
+    so checking a run again only decodes the frames that were added or changed since. The thresholds are applied
+    when reading the cache, changing them doesn't invalidate it. inspect_all() decodes on `workers` threads, the
+    decoding itself happens in the ffmpeg processes they wait on.
+    """
+
+    def __init__(
+        self,
+        black_level=2.0,
+        min_variance=1.0,
+        duplicate_distance=2,
+        workers: int | None = None,
+    ):
+        self.black_level = black_level
+        self.min_variance = min_variance
+        self.duplicate_distance = duplicate_distance
+        self.workers = workers or os.cpu_count() or 1
+        self._indexes: dict[pathlib.Path, dict] = {}
+        self._lock = threading.Lock()
+
+    def _index(self, directory: pathlib.Path):
+        with self._lock:
+            if directory not in self._indexes:
+                try:
+                    self._indexes[directory] = json.loads(
+                        (directory / VALIDATION_INDEX).read_text()
+                    )
+                except (FileNotFoundError, json.JSONDecodeError):
+                    self._indexes[directory] = {}
+            return self._indexes[directory]
+
+    def cached(self, frame: pathlib.Path, stat: os.stat_result):
+        entry = self._index(frame.parent).get(frame.name)
+        if entry is None or entry[:2] != [stat.st_size, stat.st_mtime]:
+            return None
+        _, _, complete, mean, variance, digest = entry
+        return FrameReport(
+            frame,
+            complete,
+            mean,
+            variance,
+            int(digest, 16) if digest is not None else None,
+        )
+
+    def inspect(self, frame: pathlib.Path):
+        """Measures frame, or returns the cached measurements if it hasn't changed since they were taken."""
+        stat = frame.stat()
+        report = self.cached(frame, stat)
+        if report is not None:
+            return report
+
+        report = FrameReport(frame, has_trailer(frame))
+        pixels = sample(frame, HASH_SIZE + 1, HASH_SIZE)
+        if pixels is not None:
+            report.mean = sum(pixels) / len(pixels)
+            report.variance = sum((p - report.mean) ** 2 for p in pixels) / len(pixels)
+            report.hash = difference_hash(pixels)
+        index = self._index(frame.parent)
+        with self._lock:
+            index[frame.name] = [
+                stat.st_size,
+                stat.st_mtime,
+                report.complete,
+                report.mean,
+                report.variance,
+                f"{report.hash:x}" if report.hash is not None else None,
+            ]
+        return report
+
+    def problem(self, report: FrameReport):
+        """Why the frame is unusable on its own ("truncated", "undecodable" or "blank"), None if it's fine."""
+        if not report.complete:
+            return "truncated"
+        if report.hash is None:
+            return "undecodable"
+        if report.mean < self.black_level or report.variance < self.min_variance:  # type: ignore
+            return "blank"
+        return None
+
+    def is_duplicate(self, report: FrameReport, previous: FrameReport):
+        distance = (report.hash ^ previous.hash).bit_count()  # type: ignore
+        return distance <= self.duplicate_distance
+
+    def inspect_all(self, frames: list[pathlib.Path]):
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            reports = list(pool.map(self.inspect, frames))
+        for directory in {frame.parent for frame in frames}:
+            self.save(directory)
+        return reports
+
+    def select(self, frames: list[pathlib.Path]):
+        """
+        Splits frames (in playback order) into the ones to encode and the ones to leave out, returned as
+        (kept frames, {left out frame: reason}). A duplicate is compared against the last frame kept, not just the
+        one before it, so a run of repeats collapses to its first frame.
+        """
+        kept = []
+        flagged = {}
+        previous = None
+        for report in self.inspect_all(frames):
+            reason = self.problem(report)
+            if reason is None and previous and self.is_duplicate(report, previous):
+                reason = "duplicate"
+            if reason:
+                flagged[report.path] = reason
+            else:
+                kept.append(report.path)
+                previous = report
+        if flagged:
+            counts = collections.Counter(flagged.values())
+            summary = ", ".join(f"{count} {reason}" for reason, count in counts.items())
+            logger.info(
+                f"Leaving out {len(flagged)} of {len(frames)} frames: {summary}"
+            )
+        return kept, flagged
+
+    def save(self, directory: pathlib.Path):
+        index = self._index(directory)
+        path = directory / VALIDATION_INDEX
+        temp = path.with_suffix(".tmp")
+        with self._lock:
+            temp.write_text(json.dumps(index))
+            os.replace(temp, path)
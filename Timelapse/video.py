@@ -1,55 +1,658 @@
+import asyncio
+import contextlib
+import itertools
+import json
 import logging
+import math
+import os
 import pathlib
-import subprocess
+import tempfile
+import time
+import typing
+from dataclasses import dataclass
+
+from aiofile import async_open
+
+from .ffmpeg import FFmpegProgress, FFmpegRunner
+from .metrics import Metrics
 
 logger = logging.getLogger("Timelapse.Video")
 
 
+def count_frames(directory: pathlib.Path, extension="jpg"):
+    """Number of frames ffmpeg's image2 demuxer will read from directory, 1.jpg, 2.jpg ... up to the first gap."""
+    count = 0
+    while (directory / f"{count + 1}.{extension}").exists():
+        count += 1
+    return count
+
+
+def numbered_frames(directory: pathlib.Path, extension="jpg"):
+    """Every N.jpg in directory in frame number order, gaps and all, unlike count_frames."""
+    frames = [path for path in directory.glob(f"*.{extension}") if path.stem.isdigit()]
+    return sorted(frames, key=lambda path: int(path.stem))
+
+
+def frame_ends(durations: list[float], framerate: int):
+    """When each frame stops being shown, in frames of video from the start."""
+    return [round(end * framerate) for end in itertools.accumulate(durations)]
+
+
+def concat_listing(frames: list[pathlib.Path], durations: list[float], framerate: int):
+    """
+    An ffconcat script that shows each frame for its duration in seconds, slowed down so every frame of video lasts
+    a second (VideoMaker.filters() speeds it back up). The image demuxer rounds start times to 1/25 s, which whole
+    seconds survive, where 1/24 s would not. Each duration is rounded so that the start times don't drift. The
+    demuxer ignores the duration of the last entry, so the last frame is listed once more, see listing_length.
+    """
+    lines = ["ffconcat version 1.0"]
+    start = 0
+    for frame, end in zip(frames, frame_ends(durations, framerate)):
+        escaped = str(frame.resolve()).replace("'", "'\\''")
+        lines += [f"file '{escaped}'", f"duration {end - start}"]
+        start = end
+    if frames:
+        lines.append(lines[-2])
+    return "\n".join(lines) + "\n"
+
+
+def listing_length(durations: list[float], framerate: int):
+    """How much of a concat_listing to read, up to half a frame before the repeated last frame."""
+    return str(frame_ends(durations, framerate)[-1] - 0.5)
+
+
+@dataclass
+class Preprocess:
+    """
+    What to do to every frame before it's encoded, done inside ffmpeg's filter graph so frames are never decoded
+    twice or written back to disk.
+
+    crop is (x, y, width, height) in pixels of the source frames. width and height scale the (cropped) frame, give
+    just one of them to keep the aspect ratio. stretch normalizes the contrast of each frame to the full range,
+    averaged over stretch_smoothing frames so the brightness doesn't flicker between day and night frames (each
+    segment of a segmented encode starts that average afresh).
+    """
+
+    crop: tuple[int, int, int, int] | None = None
+    width: int | None = None
+    height: int | None = None
+    stretch: bool = False
+    stretch_smoothing: int = 24
+
+    def __post_init__(self):
+        if self.crop is not None:
+            self.crop = tuple(self.crop)  # type: ignore
+            if len(self.crop) != 4 or self.crop[2] <= 0 or self.crop[3] <= 0:
+                raise ValueError(
+                    f"crop should be (x, y, width, height), not {self.crop}"
+                )
+
+    def filters(self):
+        filters = []
+        if self.crop:
+            x, y, width, height = self.crop
+            filters.append(f"crop={width}:{height}:{x}:{y}")
+        if self.width or self.height:
+            # -2 keeps the aspect ratio and an even size, area averaging looks best when shrinking
+            filters.append(f"scale={self.width or -2}:{self.height or -2}:flags=area")
+        if self.stretch:
+            filters.append(f"normalize=smoothing={self.stretch_smoothing}")
+        return filters
+
+
+@dataclass
+class OutputProfile:
+    """
+    One of several outputs made from a single decode of the frames, written to ./Videos/<video name>_<name>.<format>.
+
+    format is mp4 (H.264), webm (VP9) or gif. width and height scale the output down, give just one of them to keep
+    the aspect ratio (a frame is never scaled up then). fps drops frames down to that rate and duration keeps only
+    the first `duration` seconds, which is what a preview wants. crf trades size for quality, lower is better.
+
+    A GIF gets a palette made from its own frames, so its branch of the filter graph holds every one of its frames
+    in memory until the last has arrived. Keep GIFs small and short.
+    """
+
+    name: str
+    format: str = "mp4"
+    width: int | None = None
+    height: int | None = None
+    fps: int | None = None
+    duration: float | None = None
+    crf: int | None = None
+
+    def __post_init__(self):
+        if self.format not in ("mp4", "webm", "gif"):
+            raise ValueError(f"Can't make {self.format} videos, only mp4, webm or gif")
+
+    def filters(self):
+        filters = []
+        if self.fps:
+            filters.append(f"fps={self.fps}")
+        if self.duration:
+            filters.append(f"trim=duration={self.duration}")
+        flags = "lanczos" if self.format == "gif" else "area"
+        if self.width and self.height:
+            filters.append(
+                f"scale={self.width}:{self.height}:force_original_aspect_ratio=decrease"
+                f":force_divisible_by=2:flags={flags}"
+            )
+        elif self.width:
+            filters.append(f"scale='min({self.width},iw)':-2:flags={flags}")
+        elif self.height:
+            filters.append(f"scale=-2:'min({self.height},ih)':flags={flags}")
+        if self.format != "gif":
+            filters.append("pad=ceil(iw/2)*2:ceil(ih/2)*2")
+        return filters
+
+    def codec_args(self, gop: int, threads: int):
+        if self.format == "gif":
+            return ["-loop", "0"]
+        if self.format == "webm":
+            args = ["-vcodec", "libvpx-vp9", "-b:v", "0", "-crf", str(self.crf or 36)]
+            args += ["-row-mt", "1", "-deadline", "good", "-cpu-used", "4"]
+        else:
+            args = ["-vcodec", "libx264"]
+            if self.crf is not None:
+                args += ["-crf", str(self.crf)]
+        return [*args, "-g", str(gop), "-threads", str(threads), "-an"]
+
+
+PROFILES = {
+    "1080p": OutputProfile("1080p", height=1080),
+    "480p": OutputProfile("480p", height=480, crf=26),
+    "webm": OutputProfile("webm", "webm", height=480),
+    "gif": OutputProfile("gif", "gif", width=480, fps=10, duration=10),
+}
+
+
 class VideoMaker:
-    def __init__(self, name: str, directory: pathlib.Path, framerate=24):
+    """
+    segments > 1 splits the frames into that many chunks and encodes them side by side, see make_segmented_video.
+    threads is passed on to libx264 for every ffmpeg process (0 lets it decide), gop is the keyframe interval.
+    preprocess crops, scales and stretches the frames on the way in, the same way in every encode path.
+
+    Frames are fed to ffmpeg through an ffconcat script, so nothing has to be copied or renumbered on disk. By
+    default that's every N.jpg in directory in frame number order, skipping over missing numbers rather than
+    stopping at the first one. Given `frames`, exactly those files are encoded in that order instead (see
+    Timelapse.sequence for a run's frames in chronological order, without the ones a FrameValidator flags).
+    durations, if given, is how many seconds each of `frames` is shown for, so gaps can be held instead of
+    skipped, otherwise every frame is one frame of video.
+
+    Given output `profiles` (see PROFILES), make_video and make_video_from_stream write one output per profile
+    from a single ffmpeg process. The frames are decoded and preprocessed once, and a split filter hands them to
+    every profile's scaling and encoder. Profiles can't be combined with segments or append_video, whose outputs
+    are joined with stream copy.
+
+    The encodes are coroutines. Their ffmpeg processes run through `runner` (an FFmpegRunner), which holds them
+    to its CPU budget: each process costs `threads` cores, or an equal share of the machine per segment when
+    threads is 0. make_video_from_stream's process mostly waits for frames and isn't counted at all. Cancelling the
+    task kills the processes, and so does taking longer than `timeout` seconds (per process). progress() can be
+    polled from another thread while an encode runs. Encoding fps and speed (seconds of video per second of
+    encoding) go into `metrics`, live while encoding and for the whole encode at the end.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        directory: pathlib.Path,
+        framerate=24,
+        segments=1,
+        threads=0,
+        gop=250,
+        metrics: Metrics | None = None,
+        preprocess: Preprocess | None = None,
+        frames: list[pathlib.Path] | None = None,
+        durations: list[float] | None = None,
+        runner: FFmpegRunner | None = None,
+        timeout: float | None = None,
+        profiles: list[OutputProfile] | None = None,
+    ):
         self.name = name
         self.directory = directory
         self.framerate = framerate
+        self.segments = segments
+        self.threads = threads
+        self.gop = gop
+        self.preprocess = preprocess or Preprocess()
+        self.frames = frames
+        self.durations = durations
+        self.metrics = metrics or Metrics(name)
+        self.runner = runner or FFmpegRunner()
+        self.timeout = timeout
+        self.profiles = profiles or []
+        if self.profiles and segments > 1:
+            raise ValueError("Output profiles are made in one pass, not in segments")
+        self.total_frames: int | None = None
+        self._progress: dict[str, FFmpegProgress] = {}
 
-    def make_video(self):
+    @property
+    def output(self):
+        """The video, or the output of the first profile."""
+        return self.outputs[0]
+
+    @property
+    def outputs(self):
+        if not self.profiles:
+            return [pathlib.Path(f"./Videos/{self.name}.mp4")]
+        return [
+            pathlib.Path(f"./Videos/{self.name}_{profile.name}.{profile.format}")
+            for profile in self.profiles
+        ]
+
+    def filters(self):
+        # the inputs show every frame of video for a second, settb and setpts make that 1/framerate s without
+        # rounding. fps then makes the output constant frame rate, frames held for longer are repeated
+        return [
+            f"settb=1/{self.framerate}",
+            f"setpts=PTS/{self.framerate}",
+            f"fps={self.framerate}",
+            *self.preprocess.filters(),
+        ]
+
+    def encode_args(self):
+        filters = [*self.filters(), "pad=ceil(iw/2)*2:ceil(ih/2)*2"]
+        return [
+            "-vf",
+            ",".join(filters),
+            "-vcodec",
+            "libx264",
+            "-g",
+            str(self.gop),
+            "-threads",
+            str(self.threads),
+            "-an",
+        ]
+
+    def default_frames(self):
+        return numbered_frames(self.directory)
+
+    def sequence(self):
+        """The frames to encode and how long each is shown for, taken once at the start of every encode."""
+        if self.frames is None:
+            frames = self.default_frames()
+        else:
+            frames = list(self.frames)
+        if self.durations is None:
+            return frames, [1 / self.framerate] * len(frames)
+        if len(self.durations) != len(frames):
+            raise ValueError(
+                f"{len(self.durations)} durations given for {len(frames)} frames"
+            )
+        return frames, list(self.durations)
+
+    @contextlib.contextmanager
+    def input_args(self, frames: list[pathlib.Path], durations: list[float]):
+        """ffmpeg arguments that read `frames` through a temporary ffconcat script, removed when the context exits."""
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".ffconcat", delete=False
+        ) as listing:
+            listing.write(concat_listing(frames, durations, self.framerate))
+        try:
+            yield [
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-t",
+                listing_length(durations, self.framerate),
+                "-i",
+                listing.name,
+            ]
+        finally:
+            os.unlink(listing.name)
+
+    def output_args(self):
+        if self.profiles:
+            return self.profile_args()
+        return [*self.encode_args(), "-y", f"./{self.output}"]
+
+    def profile_args(self):
+        """
+        A filter graph that preprocesses the frames once and splits them into a branch per profile, followed by the
+        encoder options and file of each branch.
+        """
+        return self.split_args([f"[0:v]{','.join(self.filters())}[v]"], "[v]")
+
+    def split_args(self, graph: list[str], source: str):
+        """profile_args for the output labelled `source` of an existing filter graph."""
+        count = len(self.profiles)
+        labels = "".join(f"[s{i}]" for i in range(count))
+        graph = [*graph, f"{source}split={count}{labels}"]
+        args = []
+        for i, (profile, output) in enumerate(zip(self.profiles, self.outputs)):
+            chain = ",".join(profile.filters()) or "null"
+            if profile.format == "gif":
+                graph += [
+                    f"[s{i}]{chain},split[a{i}][b{i}]",
+                    f"[a{i}]palettegen=stats_mode=diff[p{i}]",
+                    f"[b{i}][p{i}]paletteuse=dither=bayer:bayer_scale=5[o{i}]",
+                ]
+            else:
+                graph.append(f"[s{i}]{chain}[o{i}]")
+            args += [
+                "-map",
+                f"[o{i}]",
+                *profile.codec_args(self.gop, self.threads),
+                "-y",
+                f"./{output}",
+            ]
+        return ["-filter_complex", ";".join(graph), *args]
+
+    @property
+    def cost(self):
+        """Cores each ffmpeg process is expected to keep busy."""
+        return self.threads or max(1, self.runner.cores // self.segments)
+
+    def start_progress(self, durations: list[float]):
+        self._progress = {}
+        self.total_frames = round(sum(durations) * self.framerate)
+
+    def on_progress(self, key: str, progress: FFmpegProgress):
+        self._progress[key] = progress
+        running = [p for p in self._progress.values() if not p.done]
+        if running:
+            self.metrics.set("encode_fps", sum(p.fps for p in running))
+            self.metrics.set("encode_speed", sum(p.speed or 0 for p in running))
+
+    def progress(self):
+        """(video frames encoded, video frames to encode, bytes written), like Downloader.progress."""
+        progress = list(self._progress.values())
+        return (
+            sum(p.frame for p in progress),
+            self.total_frames,
+            sum(p.size or 0 for p in progress),
+        )
+
+    async def run_ffmpeg(self, args: list[str], key: str | None = None, frames=None):
+        """Runs ffmpeg and returns its exit code. Progress is tracked under key, out of `frames` video frames."""
+        return await self.runner.run(
+            args,
+            cost=self.cost if key else 1,
+            total_frames=frames,
+            on_progress=(lambda progress: self.on_progress(key, progress))
+            if key
+            else None,
+            timeout=self.timeout,
+        )
+
+    def record_encode(self, frames: int, seconds: float, duration: float | None = None):
+        """duration is the length of the video made, if it isn't one frame of video per frame."""
+        if duration is None:
+            duration = frames / self.framerate
+        self.metrics.inc("frames_encoded", frames)
+        if seconds > 0:
+            self.metrics.set("encode_fps", frames / seconds)
+            self.metrics.set("encode_speed", duration / seconds)
+
+    async def make_video(self):
+        if self.segments > 1:
+            return await self.make_segmented_video()
         logger.info("Generating Video...")
+        start = time.perf_counter()
+        frames, durations = self.sequence()
+        if not frames:
+            logger.error(f"No frames found in {self.directory}")
+            return 1
+        self.start_progress(durations)
+        with self.input_args(frames, durations) as input_args:
+            args = ["ffmpeg", "-loglevel", "error", *input_args, *self.output_args()]
+            out = await self.run_ffmpeg(args, "video", self.total_frames)
+        if out == 0:
+            self.record_encode(len(frames), time.perf_counter() - start, sum(durations))
+        logger.info(f"Done! Exit code - {out}")
+        return out
+
+    def segment_bounds(self, total: int, first=1):
+        """
+        (first frame, frame count) of each segment covering frames first to total, counting from 1. Segment lengths
+        are rounded up to a multiple of the GOP so every segment starts on a keyframe of the same cadence a single
+        encode would have used (as long as no frame is held for longer than the others).
+        """
+        frames = total - first + 1
+        length = math.ceil(frames / self.segments / self.gop) * self.gop
+        bounds = [
+            (start, min(length, total - start + 1))
+            for start in range(first, total + 1, length)
+        ]
+        if len(bounds) < self.segments:
+            logger.warning(
+                f"Only {len(bounds)} of {self.segments} segments fit {frames} frames at a GOP of {self.gop}, "
+                "use a smaller GOP for more"
+            )
+        return bounds
+
+    async def encode_segment(
+        self, frames: list[pathlib.Path], durations: list[float], output: pathlib.Path
+    ):
+        with self.input_args(frames, durations) as input_args:
+            args = [
+                "ffmpeg",
+                "-loglevel",
+                "error",
+                *input_args,
+                *self.encode_args(),
+                "-y",
+                str(output),
+            ]
+            return await self.run_ffmpeg(
+                args, output.name, round(sum(durations) * self.framerate)
+            )
+
+    async def concat_segments(self, segments: list[pathlib.Path], output: pathlib.Path):
+        """Joins encoded segments with the concat demuxer, stream copy so nothing is re-encoded."""
+        listing = output.with_name(output.name + ".txt")
+        listing.write_text(
+            "".join(f"file '{segment.resolve()}'\n" for segment in segments)
+        )
         args = [
             "ffmpeg",
             "-loglevel",
-            "quiet",
-            "-stats",
-            "-framerate",
-            str(self.framerate),
+            "error",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
             "-i",
-            f"./{self.directory}/%d.jpg",
-            "-vf",
-            "pad=ceil(iw/2)*2:ceil(ih/2)*2",
-            "-vcodec",
-            "libx264",
+            str(listing),
+            "-c",
+            "copy",
             "-y",
-            "-an",
-            f"./Videos/{self.name}.mp4",
+            str(output),
         ]
-        process = subprocess.Popen(args)
-        out = process.wait()
+        try:
+            return await self.run_ffmpeg(args)
+        finally:
+            listing.unlink(missing_ok=True)
+
+    async def make_segmented_video(self):
+        """
+        Encodes GOP aligned chunks of the frame sequence in separate ffmpeg processes running concurrently, one per
+        segment, then joins them losslessly. Meant for machines where a single libx264 process can't use every core.
+        """
+        start = time.perf_counter()
+        frames, durations = self.sequence()
+        total = len(frames)
+        if total == 0:
+            logger.error(f"No frames found in {self.directory}")
+            return 1
+        bounds = self.segment_bounds(total)
+        logger.info(
+            f"Generating Video from {total} frames in {len(bounds)} segments..."
+        )
+
+        self.output.parent.mkdir(exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.output.parent) as temp:
+            segments = [
+                pathlib.Path(temp) / f"{index:04}.mp4" for index in range(len(bounds))
+            ]
+            out = await self.encode_segments(frames, durations, bounds, segments)
+            if out == 0:
+                out = await self.concat_segments(segments, self.output)
+        if out == 0:
+            self.record_encode(total, time.perf_counter() - start, sum(durations))
         logger.info(f"Done! Exit code - {out}")
+        return out
+
+    async def encode_segments(
+        self,
+        frames: list[pathlib.Path],
+        durations: list[float],
+        bounds: list[tuple[int, int]],
+        outputs: list[pathlib.Path],
+    ):
+        self.start_progress(durations[bounds[0][0] - 1 :])
+        encodes = []
+        for (first, count), output in zip(bounds, outputs):
+            chosen = slice(first - 1, first - 1 + count)
+            encodes.append(
+                self.encode_segment(frames[chosen], durations[chosen], output)
+            )
+        codes = await asyncio.gather(*encodes)
+        if any(codes):
+            logger.error(f"Segment encoding failed! Exit codes - {codes}")
+            return max(codes)
+        return 0
+
+    @property
+    def state_directory(self):
+        return self.output.parent / f".{self.name}"
+
+    @property
+    def state(self):
+        """What an appended video has to have in common with the one it extends for stream copy to work."""
+        return {
+            "framerate": self.framerate,
+            "encode_args": self.encode_args(),
+        }
+
+    async def append_video(self):
+        """
+        Extends the video with the frames added to the directory since it was last made, without re-encoding the
+        ones it already has.
+
+        Encoded segments are kept in ./Videos/.<name>/ along with segments.json, which records the first frame and
+        frame count of each, and the name and size of every frame encoded so far. Only frames past the last recorded
+        one are encoded, into new segments, and the video is re-assembled from every segment with stream copy. If
+        there is no record yet, the frames encoded so far are no longer the start of the sequence (a frame was
+        removed, or left out this time), or the framerate or encoder settings changed, every frame is encoded again.
+
+        Frames are recorded by name and size, not by directory, and the record belongs to the video name. A rolling
+        timelapse can therefore move on to a new run directory (say <start>_<end> with a later end) and only the new
+        frames get encoded, as long as the video keeps its name. Give it a fixed one, the default name changes
+        along with the directory.
 
+        With durations, the last frame of every append is shown for its duration at the time, it isn't stretched
+        over a gap that only opens up once later frames arrive.
+        """
+        if self.profiles:
+            raise ValueError("Output profiles can't be appended to, use make_video")
+        start = time.perf_counter()
+        state_file = self.state_directory / "segments.json"
+        try:
+            state = json.loads(state_file.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = None
 
-if __name__ == "__main__":
-    import time
+        frames, durations = self.sequence()
+        total = len(frames)
+        encoded = sum(segment["count"] for segment in state["segments"]) if state else 0
+        recorded = [[frame.name, frame.stat().st_size] for frame in frames]
+        if (
+            state is None
+            or state["settings"] != self.state
+            or total < encoded
+            or state.get("frames") != recorded[:encoded]
+        ):
+            logger.info("No usable segments for this video, encoding every frame")
+            state = {"settings": self.state, "segments": []}
+            encoded = 0
+            self.state_directory.mkdir(parents=True, exist_ok=True)
+            for old in self.state_directory.glob("*.mp4"):
+                old.unlink()
 
-    import anytree
+        if total == encoded:
+            logger.info(f"No new frames in {self.directory}, nothing to append")
+            return 0
 
-    logging.basicConfig(level=logging.DEBUG)
+        bounds = self.segment_bounds(total, first=encoded + 1)
+        index = len(state["segments"])
+        files = [f"{index + i:04}.mp4" for i in range(len(bounds))]
+        logger.info(
+            f"Appending frames {encoded + 1} to {total} in {len(bounds)} segments..."
+        )
+        out = await self.encode_segments(
+            frames,
+            durations,
+            bounds,
+            [self.state_directory / file for file in files],
+        )
+        if out:
+            return out
 
-    resolver = anytree.Resolver()
-    path = pathlib.Path(
-        "./Images/INSAT-3D/IMAGER/Special/Blended Image/03Aug2023_03Aug2023"
-    )
-    video = VideoMaker("Test", path)
+        for (first, count), file in zip(bounds, files):
+            state["segments"].append({"file": file, "start": first, "count": count})
+        state["frames"] = recorded
+        state_file.write_text(json.dumps(state, indent=1))
 
-    a = time.perf_counter()
-    video.make_video()
-    delta = time.perf_counter() - a
+        segments = [
+            self.state_directory / segment["file"] for segment in state["segments"]
+        ]
+        out = await self.concat_segments(segments, self.output)
+        if out == 0:
+            self.record_encode(
+                total - encoded,
+                time.perf_counter() - start,
+                sum(durations[encoded:]),
+            )
+        logger.info(f"Done! Exit code - {out}")
+        return out
+
+    async def make_video_from_stream(self, frames: typing.AsyncIterator[pathlib.Path]):
+        """
+        Same as make_video, but the frames are piped into ffmpeg's stdin (image2pipe) one at a time, in the order
+        `frames` yields them, so encoding can start before the last frame exists.
+        """
+        logger.info("Generating Video from stream...")
+        start = time.perf_counter()
+        self._progress = {}
+        self.total_frames = None
+        count = 0
 
-    print(f"Completed in {delta} seconds")
+        async def feed(stdin: asyncio.StreamWriter):
+            nonlocal count
+            try:
+                async for path in frames:
+                    async with async_open(path, "rb") as file:
+                        data = await file.read()
+                    stdin.write(data)
+                    await stdin.drain()
+                    count += 1
+            except (BrokenPipeError, ConnectionResetError):
+                logger.error("ffmpeg stopped accepting frames")
+
+        # a frame a second like the ffconcat listings, filters() brings it up to framerate
+        args = [
+            "ffmpeg",
+            "-loglevel",
+            "error",
+            "-f",
+            "image2pipe",
+            "-framerate",
+            "1",
+            "-i",
+            "-",
+            *self.output_args(),
+        ]
+        # the process waits on the download most of the time, holding even one core of the budget for that long
+        # would stall every encode that wants the whole machine
+        out = await self.runner.run(
+            args,
+            cost=0,
+            on_progress=lambda progress: self.on_progress("video", progress),
+            feed=feed,
+        )
+        if out == 0:
+            self.record_encode(count, time.perf_counter() - start)
+        logger.info(f"Done! Encoded {count} frames. Exit code - {out}")
+        return out
@@ -0,0 +1,197 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import pathlib
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from . import download, encode
+
+
+def configure_logging(level):
+    logging.basicConfig(level=level, format="%(levelname)s %(name)s: %(message)s")
+    for name in ("asyncio", "httpcore", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def in_fresh_process(level, function, *args, **kwargs):
+    """Runs function in a new interpreter so that peak RSS measurements don't carry over between runs."""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=context,
+        initializer=configure_logging,
+        initargs=(level,),
+    ) as pool:
+        return pool.submit(function, *args, **kwargs).result()
+
+
+def print_table(results: list[dict]):
+    columns = list(results[0])
+    rows = [
+        [
+            f"{value:.2f}" if isinstance(value, float) else str(value)
+            for value in result.values()
+        ]
+        for result in results
+    ]
+    widths = [
+        max(len(column), *(len(row[i]) for row in rows))
+        for i, column in enumerate(columns)
+    ]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.rjust(width) for value, width in zip(row, widths)))
+
+
+def configuration(result: dict):
+    return tuple(
+        result[key]
+        for key in ("workers", "segments", "threads", "mode")
+        if key in result
+    )
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float):
+    """Returns the runs whose frames/s fell more than tolerance (a fraction) below the baseline run of the same setup."""
+    previous = {configuration(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(configuration(result))
+        if old is None:
+            continue
+        if result["frames_per_second"] < old["frames_per_second"] * (1 - tolerance):
+            regressions.append((result, old))
+    return regressions
+
+
+def benchmark_download(args):
+    fake_settings = {
+        "latency": args.latency,
+        "bandwidth": args.bandwidth,
+        "error_rate": args.error_rate,
+        "not_found_rate": args.not_found_rate,
+        "image_size": args.image_size,
+        "seed": args.seed,
+    }
+    results = []
+    for workers in args.workers:
+        result = in_fresh_process(
+            args.log_level,
+            download.run,
+            workers,
+            args.days,
+            args.retry_delay,
+            **fake_settings,
+        )
+        results.append(result)
+        print(
+            f"{workers} workers: {result['frames_per_second']:.1f} frames/s",
+            file=sys.stderr,
+        )
+    return results
+
+
+def benchmark_encode(args):
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        print(f"Making {args.frames} {args.size} frames...", file=sys.stderr)
+        encode.make_frames(
+            pathlib.Path(scratch) / encode.FRAMES_DIRECTORY, args.frames, args.size
+        )
+        for stream in (False, True) if args.stream else (False,):
+            for segments in args.segments:
+                for threads in args.threads:
+                    if stream and segments > 1:
+                        continue  # the stream encode is always a single process
+                    result = in_fresh_process(
+                        args.log_level, encode.run, scratch, segments, threads, stream
+                    )
+                    results.append(result)
+                    print(
+                        f"{result['mode']} segments={segments} threads={threads}: "
+                        f"{result['frames_per_second']:.1f} frames/s",
+                        file=sys.stderr,
+                    )
+    return results
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Throughput of the downloader against a fake MOSDAC, and of the encoder on synthetic frames.",
+    )
+    parser.add_argument("--json", type=pathlib.Path, help="also write the results here")
+    parser.add_argument(
+        "--baseline",
+        type=pathlib.Path,
+        help="results of an earlier run (from --json), exit with 1 if frames/s regressed",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="how much slower than the baseline still passes (default: %(default)s)",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    dl = commands.add_parser("download", help="download frames from a fake MOSDAC")
+    dl.add_argument("--workers", type=int, nargs="+", default=[8, 16, 32, 64])
+    dl.add_argument("--days", type=int, default=4, help="48 frames per day")
+    dl.add_argument("--latency", type=float, default=0.05, help="seconds per response")
+    dl.add_argument(
+        "--bandwidth", type=float, default=None, help="bytes/s per image body"
+    )
+    dl.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="chance of a 503 per image request",
+    )
+    dl.add_argument(
+        "--not-found-rate", type=float, default=0.0, help="share of frames that 404"
+    )
+    dl.add_argument("--image-size", type=int, default=200_000, help="bytes per image")
+    dl.add_argument(
+        "--retry-delay", type=float, default=0.1, help="base delay of the retry backoff"
+    )
+    dl.add_argument("--seed", type=int, default=0)
+
+    enc = commands.add_parser("encode", help="encode synthetic frames")
+    enc.add_argument("--frames", type=int, default=480)
+    enc.add_argument("--size", default="1280x720")
+    enc.add_argument("--segments", type=int, nargs="+", default=[1, 4])
+    enc.add_argument("--threads", type=int, nargs="+", default=[0])
+    enc.add_argument("--stream", action="store_true", help="also time the piped encode")
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    args.log_level = logging.INFO if args.verbose else logging.ERROR
+    configure_logging(args.log_level)
+
+    if args.command == "download":
+        results = benchmark_download(args)
+    else:
+        results = benchmark_encode(args)
+    print_table(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=1))
+
+    if args.baseline:
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for result, old in regressions:
+            print(
+                f"Regression at {configuration(result)}: {result['frames_per_second']:.1f} frames/s, "
+                f"was {old['frames_per_second']:.1f}",
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+    return 0
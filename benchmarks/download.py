@@ -0,0 +1,67 @@
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import anytree
+import httpx
+
+from Timelapse import Downloader, Metrics
+from Timelapse.client import PerHostLimitTransport
+from Timelapse.controller import RetryPolicy
+from Timelapse.settings import Product
+
+from .fake_mosdac import PATTERN, FakeMosdac
+from .resources import peak_rss
+
+START = datetime(2023, 7, 1)
+PER_HOST = 16
+
+
+async def download(fake: FakeMosdac, workers: int, days: int, retry_delay: float):
+    product = Product("SIR", pattern=PATTERN, parent=anytree.Node("Settings"))
+    transport = PerHostLimitTransport(fake.transport(), PER_HOST)
+    metrics = Metrics(f"download-{workers}")
+    async with httpx.AsyncClient(transport=transport) as client:
+        downloader = Downloader(
+            client,
+            "Benchmark",
+            product,
+            START,
+            START + timedelta(days=days, minutes=-1),
+            num_workers=workers,
+            retry_policy=RetryPolicy(base_delay=retry_delay),
+            metrics=metrics,
+        )
+        await downloader.run()
+    return metrics
+
+
+def run(workers: int, days: int, retry_delay: float, **fake_settings):
+    """
+    One download of `days` days of frames with `workers` workers, in a scratch directory. Meant to be run in a
+    fresh process, so that peak RSS belongs to this run alone.
+    """
+    fake = FakeMosdac(**fake_settings)
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        start = time.perf_counter()
+        metrics = asyncio.run(download(fake, workers, days, retry_delay))
+        elapsed = time.perf_counter() - start
+    snapshot = metrics.snapshot()
+    counters = snapshot["counters"]
+    latency = snapshot["histograms"]["request_latency_seconds"]
+    frames = counters.get("frames_settled", 0) - counters.get("frames_failed", 0)
+    return {
+        "workers": workers,
+        "frames": frames,
+        "seconds": elapsed,
+        "frames_per_second": frames / elapsed,
+        "mb_per_second": counters.get("bytes_downloaded", 0) / elapsed / 1024 / 1024,
+        "retries": counters.get("retries", 0),
+        "not_found": counters.get("not_found", 0),
+        "latency_p90": latency["p90"],
+        "utilization": snapshot["rates"]["worker_utilization"],
+        "peak_rss_mb": peak_rss(),
+    }
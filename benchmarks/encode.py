@@ -0,0 +1,80 @@
+import asyncio
+import os
+import pathlib
+import subprocess
+import time
+
+from Timelapse import Metrics, VideoMaker
+from Timelapse.video import count_frames
+
+from .resources import peak_rss
+
+FRAMES_DIRECTORY = pathlib.Path("Frames")
+
+
+def make_frames(directory: pathlib.Path, count: int, size: str, quality=3):
+    """count JPEGs of ffmpeg's moving test pattern, 1.jpg to N.jpg, so every run encodes the same input."""
+    directory.mkdir(parents=True, exist_ok=True)
+    if count_frames(directory) >= count:
+        return
+    args = [
+        "ffmpeg",
+        "-loglevel",
+        "error",
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc2=size={size}:rate=24",
+        "-frames:v",
+        str(count),
+        "-q:v",
+        str(quality),
+        "-y",
+        str(directory / "%d.jpg"),
+    ]
+    subprocess.run(args, check=True)
+
+
+async def stream_frames(directory: pathlib.Path, count: int):
+    for number in range(1, count + 1):
+        yield directory / f"{number}.jpg"
+
+
+def run(scratch: str, segments: int, threads: int, stream: bool):
+    """
+    One encode of the frames in <scratch>/Frames. Meant to be run in a fresh process, so that the peak RSS of
+    its children is ffmpeg's during this run alone.
+    """
+    os.chdir(scratch)
+    frames = count_frames(FRAMES_DIRECTORY)
+    name = f"bench-{segments}-{threads}-{'stream' if stream else 'files'}"
+    video = VideoMaker(
+        name,
+        FRAMES_DIRECTORY,
+        segments=segments,
+        threads=threads,
+        metrics=Metrics(name),
+    )
+    # normally made by the Downloader
+    video.output.parent.mkdir(exist_ok=True)
+    start = time.perf_counter()
+    if stream:
+        code = asyncio.run(
+            video.make_video_from_stream(stream_frames(FRAMES_DIRECTORY, frames))
+        )
+    else:
+        code = asyncio.run(video.make_video())
+    elapsed = time.perf_counter() - start
+    if code != 0:
+        raise RuntimeError(f"ffmpeg exited with {code}")
+    return {
+        "segments": segments,
+        "threads": threads,
+        "mode": "stream" if stream else "files",
+        "frames": frames,
+        "seconds": elapsed,
+        "frames_per_second": frames / elapsed,
+        "speed": frames / video.framerate / elapsed,
+        "output_mb": video.output.stat().st_size / 1024 / 1024,
+        "peak_rss_mb": peak_rss(children=True),
+    }
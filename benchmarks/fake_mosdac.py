@@ -0,0 +1,98 @@
+import asyncio
+import json
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import httpx
+
+PATTERN = "_L1C_SIR.jpg"
+
+
+def frame_name(timestamp: datetime):
+    """Same shape as the paths MOSDAC hands out, e.g. 3D_IMG/gallery/2023-07-21/3DIMG_21JUL2023_0000_L1C_SIR.jpg"""
+    name = f"3DIMG_{timestamp:%d%b%Y}_{timestamp:%H%M}".upper()
+    return f"3D_IMG/gallery/{timestamp:%Y-%m-%d}/{name}{PATTERN}"
+
+
+@dataclass
+class FakeMosdac:
+    """
+    A stand-in for the three MOSDAC endpoints the app talks to, served through an httpx.MockTransport so that
+    benchmarks don't depend on the network or on MOSDAC's mood that day.
+
+    latency is the wait before every response, bandwidth (bytes per second, None for unlimited) paces each image
+    body in chunks. error_rate is the chance that any image request gets a 503, so retries eventually get through.
+    not_found_rate is the share of frames that always 404. Images are image_size bytes of noise, the downloader
+    never looks inside them.
+    """
+
+    latency: float = 0.05
+    bandwidth: float | None = None
+    error_rate: float = 0.0
+    not_found_rate: float = 0.0
+    image_size: int = 200_000
+    cadence: timedelta = timedelta(minutes=30)
+    seed: int = 0
+    requests: int = field(default=0, init=False)
+
+    def __post_init__(self):
+        self.random = random.Random(self.seed)
+        self.body = random.Random(self.seed).randbytes(self.image_size)
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    def missing(self, name: str):
+        return random.Random(f"{self.seed}/{name}").random() < self.not_found_rate
+
+    async def handle(self, request: httpx.Request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        path = request.url.path
+        if path.endswith("getImage.php"):
+            return self.get_image(json.loads(request.content))
+        if path.endswith("product.json"):
+            return httpx.Response(200, json=self.products())
+        name = path.split("/look/", 1)[-1]
+        if self.missing(name):
+            return httpx.Response(404)
+        if self.random.random() < self.error_rate:
+            return httpx.Response(503)
+        return httpx.Response(
+            200,
+            headers={"Content-Length": str(self.image_size)},
+            content=self.stream_body(),
+        )
+
+    def get_image(self, query: dict):
+        """The `count` frames before the end of st_date, oldest first, as one comma separated string in a list."""
+        end = datetime.strptime(query["st_date"], "%Y-%m-%d") + timedelta(days=1)
+        count = int(float(query["count"]))
+        names = [frame_name(end - self.cadence * i) for i in range(count, 0, -1)]
+        return httpx.Response(200, json=[",".join(names)])
+
+    def products(self):
+        return [
+            {
+                "sat": "BENCH",
+                "sensor": [
+                    {
+                        "sen": "IMAGER",
+                        "type": [
+                            {
+                                "product": "Standard",
+                                "prodlist": [{"prod": "SIR", "pat": PATTERN}],
+                            }
+                        ],
+                    }
+                ],
+            }
+        ]
+
+    async def stream_body(self, chunk_size=64 * 1024):
+        for start in range(0, self.image_size, chunk_size):
+            chunk = self.body[start : start + chunk_size]
+            if self.bandwidth:
+                await asyncio.sleep(len(chunk) / self.bandwidth)
+            yield chunk
@@ -1,3 +1,4 @@
+import argparse
 import logging
 
 import dearpygui.dearpygui as dpg
@@ -6,13 +7,15 @@ import GUI
 import Timelapse
 
 
-def main():
+def main(offline=False, per_host=None):
     dpg.create_context()
     dpg.create_viewport(title="Timelapse Generator")
     TimelapseLogger = logging.getLogger("Timelapse")
     GUI_Logger = logging.getLogger("GUI")
     TimelapseLogger.setLevel(logging.DEBUG)
     GUI_Logger.setLevel(logging.DEBUG)
+    catalog = Timelapse.FrameCatalog()
+    engine = GUI.JobEngine(per_host=per_host)
     formatter = logging.Formatter(
         "[{asctime}] [{levelname:<8}] {name}: {message}", "%H:%M:%S", style="{"
     )
@@ -40,24 +43,47 @@ def main():
                     TimelapseLogger.addHandler(log)
                     GUI_Logger.addHandler(log)
                 with dpg.child_window(height=350) as product_selector_window:
-                    settings_root = Timelapse.make_settings_tree()
+                    settings_root = Timelapse.make_settings_tree(offline=offline)
                     settings_tree = GUI.TreeSelector(
                         settings_root, parent=product_selector_window
                     )
             with dpg.table_row():
                 with dpg.child_window() as explorer_window:
-                    GUI.Explorer(parent=explorer_window)
+                    GUI.Explorer(parent=explorer_window, catalog=catalog, engine=engine)
                 with dpg.child_window() as downloader_window:
                     GUI.DownloaderWindow(
-                        product_selector=settings_tree, parent=downloader_window
+                        product_selector=settings_tree,
+                        parent=downloader_window,
+                        catalog=catalog,
+                        engine=engine,
                     )
+                    dpg.add_separator()
+                    jobs = GUI.JobList(engine, parent=downloader_window)
 
     dpg.setup_dearpygui()
     dpg.set_primary_window("Primary Window", True)
     dpg.show_viewport(maximized=True)
-    dpg.start_dearpygui()
+    # a manual render loop instead of start_dearpygui() so the log and the job list are refreshed every frame
+    while dpg.is_dearpygui_running():
+        log.drain()
+        jobs.update()
+        dpg.render_dearpygui_frame()
+    engine.shutdown()
+    catalog.commit()
     dpg.destroy_context()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="INSAT-3D Timelapse Generator")
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="use the cached product catalog and never fetch it from MOSDAC",
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        help="requests in flight to each MOSDAC host across every job (default: only the connection pool caps them)",
+    )
+    args = parser.parse_args()
+    main(offline=args.offline, per_host=args.per_host)